@@ -1,16 +1,32 @@
+import bisect
+import itertools
 import json
 import operator
-import random
 import time
 
+from math import exp, sqrt
+
 import numpy
-from math import exp
+
+from Checkpoint import latest_checkpoint, load_checkpoint
+from Labyrinth import ACTION_INDEX, ACTIONS, REWARDS
+from Metrics import TIMED_PHASES
+from QTable import ArrayQTable, SparseQTable
+from RandomStream import RandomStream
+from ReplayBuffer import ReplayBuffer
+from Schedule import VisitCounter, as_schedule
 
 
 class Agent:
 
     def __init__(self, policy, environment, nb_episodes, exploration_rate=-1,
-                 temperature=-1, discount_rate=-1, learning_rate=0.9):
+                 temperature=-1, discount_rate=-1, learning_rate=0.9,
+                 headless=False, step_delay=0.1, notify_every=1, notify_interval=0, q_backend="dict",
+                 temperature_schedule=None, seed=None, rng=None, convergence=None, convergence_threshold=1e-3,
+                 convergence_patience=5, max_steps_per_episode=None, time_budget=None, metrics=None,
+                 planning_steps=0, planning_batch_size=32, replay_capacity=100000,
+                 exploration_schedule=None, learning_rate_schedule=None, exploration_bonus=0.0,
+                 start="fixed", start_cell=(0, 0), checkpointer=None):
         """
         Creates an agent in an environment.
         :param {str} policy: AI of the agent. Possible values: random|e-greedy|softmax
@@ -21,7 +37,58 @@ class Agent:
         :param {float} temperature: if selected ai is softmax,
                                     represents the temperature ([0, oo[)
         :param {float} discount_rate: Discount factor, must be in range [0, 1]
+        :param {float} learning_rate: Learning rate, must be in range [0, 1]
+        :param {bool} headless: if True, the agent never sleeps nor notifies its observers
+                                (overrides step_delay and notify_every)
+        :param {float} step_delay: pause (in seconds) after each step, used to pace the visualisation
+        :param {int} notify_every: the observers are notified every notify_every steps (0 disables notifications)
+        :param {float} notify_interval: minimum time (in milliseconds) between two notifications
+        :param {str} q_backend: storage of the Q values. Possible values: dict|numpy|sparse
+                                (dict: nested list of dicts, numpy: dense (height, width, 4) array,
+                                 sparse: (n_states, 4) array of the states reachable from the start cells)
+        :param temperature_schedule: if given, a schedule (see Schedule) or a function step -> temperature evaluated
+                                     at each softmax step (step is the number of steps since the agent was created)
+        :param {int} seed: Seed of the random stream of the agent (a fresh one is drawn if None)
+        :param {RandomStream.RandomStream} rng: Random stream of the agent, e.g. spawned for a parallel worker
+                                               (takes precedence over seed)
+        :param {str} convergence: early stopping criterion. Possible values: None|q-delta|greedy-path
+                                  (q-delta: the largest Q change of an episode is below convergence_threshold,
+                                   greedy-path: the greedy path from start_cell to the goal did not change)
+        :param {float} convergence_threshold: threshold of the q-delta criterion
+        :param {int} convergence_patience: number of consecutive episodes the criterion must hold to stop
+        :param {int} max_steps_per_episode: if given, an episode is cut after this number of steps
+        :param {float} time_budget: if given, the training stops after this number of seconds
+        :param metrics: if given, a sink (see Metrics) receiving one record per episode of learn and optimal_play
+                        (steps, return, trap hits, largest Q change, time spent in each phase of a step)
+        :param {int} planning_steps: Dyna-Q planning: number of batch backups on transitions drawn from the replay
+                                     buffer after each real step (0 disables the replay buffer, needs q_backend=numpy)
+        :param {int} planning_batch_size: number of transitions of a planning backup
+        :param {int} replay_capacity: maximum number of transitions kept in the replay buffer
+        :param exploration_schedule: if given, a schedule (see Schedule) of the exploration rate, evaluated at each
+                                     e-greedy step with the number of visits of the current state
+        :param learning_rate_schedule: if given, a schedule of the learning rate, evaluated at each update with the
+                                       number of visits of the updated (state, action), e.g. Schedule.VisitDecay
+        :param {float} exploration_bonus: if positive, e-greedy picks its best action on
+                                          Q(s, a) + exploration_bonus / sqrt(1 + n(s, a)), n being the visit count
+        :param {str} start: distribution of the first cell of the learning episodes. Possible values:
+                            fixed|uniform|inverse-visits (fixed: start_cell, uniform: any cell that leads to the goal,
+                            see Labyrinth.start_candidates, inverse-visits: the same cells weighted by
+                            1 / (1 + visits of the cell))
+        :param start_cell: the first cell of the fixed start, of optimal_play and of the greedy-path criterion
+                           (must be one of the start candidates of the labyrinth)
+        :param checkpointer: if given, a Checkpoint.Checkpointer to which learn hands a snapshot of the training
+                             (Q values, episode, visit counts, replay buffer, random stream) when one is due,
+                             and at the end of the training (see resume)
         """
+        exploration_schedule = as_schedule(exploration_schedule)
+        temperature_schedule = as_schedule(temperature_schedule)
+        learning_rate_schedule = as_schedule(learning_rate_schedule)
+        if exploration_schedule is not None:
+            exploration_rate = exploration_schedule(0)
+        if temperature_schedule is not None:
+            temperature = temperature_schedule(0)
+        if learning_rate_schedule is not None:
+            learning_rate = learning_rate_schedule(0)
         if policy == 'e-greedy' and (exploration_rate <= 0 or exploration_rate > 1):
             raise ValueError("Exploration rate must be in range [0, 1] if selected policy is ε-greedy !")
         if policy == 'softmax' and temperature <= 0:
@@ -30,6 +97,30 @@ class Agent:
             raise ValueError("Discount rate must be in range [0, 1] !")
         if learning_rate < 0 or learning_rate > 1:
             raise ValueError("Learning rate must be in range [0, 1] !")
+        if q_backend not in ('dict', 'numpy', 'sparse'):
+            raise ValueError("Q-table backend must be dict, numpy or sparse !")
+        if convergence not in (None, 'q-delta', 'greedy-path'):
+            raise ValueError("Convergence criterion must be q-delta or greedy-path !")
+        if convergence_patience < 1:
+            raise ValueError("Convergence patience must be at least one episode !")
+        if step_delay < 0:
+            raise ValueError("Step delay must be positive !")
+        if notify_every < 0 or notify_interval < 0:
+            raise ValueError("Notification throttling parameters must be positive !")
+        if planning_steps < 0 or planning_batch_size < 1:
+            raise ValueError("Planning steps must be positive and planning batches not empty !")
+        if planning_steps and q_backend != 'numpy':
+            raise ValueError("Planning needs the numpy Q-table backend !")
+        if exploration_bonus < 0:
+            raise ValueError("Exploration bonus must be positive !")
+        if start not in ('fixed', 'uniform', 'inverse-visits'):
+            raise ValueError("Start distribution must be fixed, uniform or inverse-visits !")
+        start_cell = tuple(start_cell)
+        if not environment.is_start_candidate(*start_cell):
+            raise ValueError("The start cell must be inside the labyrinth, neither a rock nor the goal, "
+                             "and lead to the goal !")
+        # plain ints: the cell ends up in the greedy paths and in the JSON state of the checkpoints
+        start_cell = (int(start_cell[0]), int(start_cell[1]))
 
         self.policy = policy
         self.temperature = temperature
@@ -38,6 +129,34 @@ class Agent:
         self.discount_rate = discount_rate
         self.learning_rate = learning_rate
         self.exploration_rate = exploration_rate
+        self.q_backend = q_backend
+        self.temperature_schedule = temperature_schedule
+        self.exploration_schedule = exploration_schedule
+        self.learning_rate_schedule = learning_rate_schedule
+        self.exploration_bonus = exploration_bonus
+        self.total_steps = 0
+        # Early stopping and budgets of the training
+        self.convergence = convergence
+        self.convergence_threshold = convergence_threshold
+        self.convergence_patience = convergence_patience
+        self.max_steps_per_episode = max_steps_per_episode
+        self.time_budget = time_budget
+        # largest absolute Q change since the start of the current episode
+        self.episode_max_delta = 0.0
+        # Instrumentation: time spent in each phase of the steps of the current episode and number of traps hit
+        self.metrics = metrics
+        self.episode_timings = dict.fromkeys(TIMED_PHASES, 0.0)
+        self.trap_hits = 0
+        # Dyna-Q planning: the real transitions are stored in a replay buffer and backed up again by batches
+        self.planning_steps = planning_steps
+        self.planning_batch_size = planning_batch_size
+        self.replay = ReplayBuffer(replay_capacity) if planning_steps else None
+        # Visits of each (state, action), used by the schedules and the exploration bonus
+        uses_visits = (exploration_schedule or temperature_schedule or learning_rate_schedule or exploration_bonus
+                       or start == 'inverse-visits')
+        self.visits = VisitCounter(environment) if uses_visits else None
+        # Random stream of the policies, its seed is recorded in the exported models
+        self.rng = rng if rng is not None else RandomStream(seed)
 
         # Supported policies for this agent.
         self.policies = {
@@ -49,19 +168,47 @@ class Agent:
 
         # List of observer to update(GUI)
         self.observers = []
+        # Pacing and throttling of the notifications. A headless agent runs as fast as possible.
+        self.step_delay = 0 if headless else step_delay
+        self.notify_every = 0 if headless else notify_every
+        self.notify_interval = notify_interval
+        self.steps_since_notification = 0
+        self.last_notification = 0.0
+        # if track_changes is set (by the GUI), the (i, j, action) of every updated Q value is added to changed_Q
+        self.track_changes = False
+        self.changed_Q = set()
+        # First cell of the episodes
+        self.start = start
+        self.start_cell = start_cell
         self.current_episode = 1
-        self.current_location = (0, 0)
-        self.possible_actions = self.environment.get_possible_actions(*self.current_location)
 
         # Q values initialisation
         self.init_Q()
+        # Current cell, its possible actions and its index in the Q values (see set_location)
+        self.set_location(start_cell)
 
         self.total_reward = 0.0
         self.action_taken = None
         self.learning_done = False
         self.stop = False
+        self.training_summary = None
+        # Checkpoints of the training, and the progress of learn restored by resume
+        self.checkpointer = checkpointer
+        self.resumed_progress = None
 
     def init_Q(self):
+        self.changed_Q = set()
+        if self.replay is not None:
+            self.replay.clear()
+        if self.visits is not None:
+            # the labyrinth may have been replaced
+            self.visits = VisitCounter(self.environment)
+        if self.q_backend == 'numpy':
+            self.Q = ArrayQTable(self.environment)
+            return
+        if self.q_backend == 'sparse':
+            self.Q = SparseQTable(self.environment, self.sparse_starts())
+            return
         self.Q = []
         for i in range(len(self.environment.adjacency_matrix)):
             self.Q.append([])
@@ -69,6 +216,50 @@ class Agent:
                 self.Q[i].append([])
                 self.Q[i][j] = {action: 0 for action in self.environment.get_possible_actions(i, j)}
 
+    def export_Q(self):
+        """
+        :return: The Q values in the nested list-of-dicts layout used by the JSON models.
+        """
+        if self.q_backend != 'dict':
+            return self.Q.to_dict()
+        return self.Q
+
+    def sparse_starts(self):
+        """
+        :return: The states the episodes can start from, whose reachable states are stored by the sparse backend
+        """
+        if self.start == 'fixed':
+            return [self.environment.state_index(*self.start_cell)]
+        return self.environment.start_candidates
+
+    def load_Q(self, q_values):
+        """
+        Replaces the Q values of this agent.
+        :param q_values: Q values in the nested list-of-dicts layout used by the JSON models, a QTable.ArrayQTable
+                         or a QTable.SparseQTable
+        """
+        self.changed_Q = set()
+        if self.replay is not None:
+            self.replay.clear()
+        if self.visits is not None:
+            # the labyrinth may have been replaced (see LabyrinthGUI.import_model)
+            self.visits = VisitCounter(self.environment)
+        if isinstance(q_values, SparseQTable) and self.q_backend != 'sparse':
+            q_values = ArrayQTable.from_array(q_values.to_array(), self.environment)
+        if isinstance(q_values, SparseQTable):
+            self.Q = q_values
+        elif isinstance(q_values, ArrayQTable):
+            if self.q_backend == 'sparse':
+                self.Q = SparseQTable.from_array(q_values.values, self.environment, self.sparse_starts())
+            else:
+                self.Q = q_values if self.q_backend == 'numpy' else q_values.to_dict()
+        elif self.q_backend == 'numpy':
+            self.Q = ArrayQTable.from_dict(q_values, self.environment)
+        elif self.q_backend == 'sparse':
+            self.Q = SparseQTable.from_dict(q_values, self.environment, self.sparse_starts())
+        else:
+            self.Q = q_values
+
     def play(self):
         if self.learning_done:
             self.optimal_play()
@@ -78,57 +269,375 @@ class Agent:
     def learn(self):
         """
         Starts the learning process of the agent.
-        The agent learns with a Q-learning algorithm with a given policy.
+        The agent learns with a Q-learning algorithm with a given policy, during nb_episodes episodes
+        or until the convergence criterion holds or the time budget is spent.
+        After resume, the training continues from the episode following the checkpoint
+        (the time budget starts again).
+        :return: A training summary (steps and total reward per episode, number of truncated episodes,
+                 reason of the end of the training, wall time in seconds)
         """
-        t = 1
-        while t < self.nb_episodes and not self.stop:
-            self.current_episode = t
-            self.current_location = (0, 0)
-            self.possible_actions = self.environment.get_possible_actions(*self.current_location)
-            self.total_reward = 0.0
-            while not self.environment.is_out(*self.current_location) and not self.stop:
+        start_time = time.perf_counter()
+        deadline = start_time + self.time_budget if self.time_budget is not None else None
+        progress = self.resumed_progress or {}
+        self.resumed_progress = None
+        steps_per_episode = list(progress.get("steps", []))
+        rewards_per_episode = list(progress.get("rewards", []))
+        truncated = progress.get("truncated", 0)
+        stable_episodes = progress.get("stable_episodes", 0)
+        previous_path = progress.get("previous_path")
+        stop_reason = "episodes"
+        t = len(steps_per_episode) + 1
+        saved = t - 1
+        while t <= self.nb_episodes and not self.stop:
+            (steps, cut) = self.run_episode(t, deadline)
+            truncated += cut
+            steps_per_episode.append(steps)
+            rewards_per_episode.append(self.total_reward)
+            t += 1
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                stop_reason = "time_budget"
+                break
+            if self.convergence is not None:
+                if self.convergence == 'q-delta':
+                    stable = self.episode_max_delta < self.convergence_threshold
+                else:
+                    path = self.greedy_path()
+                    stable = path is not None and path == previous_path
+                    previous_path = path
+                stable_episodes = stable_episodes + 1 if stable else 0
+                if stable_episodes >= self.convergence_patience:
+                    stop_reason = "converged"
+                    break
+            if self.checkpointer is not None and self.checkpointer.due(t - 1):
+                self.checkpointer.save(self.checkpoint_state(steps_per_episode, rewards_per_episode, truncated,
+                                                             stable_episodes, previous_path))
+                saved = t - 1
+        if self.stop:
+            stop_reason = "stopped"
+        if self.checkpointer is not None:
+            if saved < len(steps_per_episode):
+                self.checkpointer.save(self.checkpoint_state(steps_per_episode, rewards_per_episode, truncated,
+                                                             stable_episodes, previous_path))
+            self.checkpointer.wait()
+        if self.metrics is not None:
+            self.metrics.flush()
+        self.training_summary = {
+            "episodes": len(steps_per_episode),
+            "steps": steps_per_episode,
+            "rewards": rewards_per_episode,
+            "truncated": truncated,
+            "stop_reason": stop_reason,
+            "wall_time": time.perf_counter() - start_time
+        }
+        return self.training_summary
+
+    def run_episode(self, episode, deadline=None):
+        """
+        Plays one learning episode, from a start cell drawn by pick_start until the goal.
+        The episode is cut after max_steps_per_episode steps, at the deadline or when self.stop is set.
+        :param {int} episode: The number of the episode (used by the schedules and the metrics)
+        :param {float} deadline: if given, the time.perf_counter() value at which the episode is cut
+        :return: (number of steps, True if the episode was cut by max_steps_per_episode)
+        """
+        self.current_episode = episode
+        self.set_location(self.pick_start())
+        self.total_reward = 0.0
+        self.episode_max_delta = 0.0
+        self.reset_episode_metrics()
+        episode_start = time.perf_counter()
+        steps = 0
+        truncated = False
+        while not self.environment.is_out(*self.current_location) and not self.stop:
+            if steps == self.max_steps_per_episode:
+                truncated = True
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if self.metrics is None:
                 action = self.policies[self.policy]()
                 reward = self.environment.get_reward(self.current_location, action)
                 # update our location and possible actions
                 self.action_taken = action
                 self.update_state(action, reward)
-                if self.environment.adjacency_matrix[self.current_location[0]][self.current_location[1]] == 0:
-                    raise ValueError("je suis dans un endroit interdit !!!")
-                time.sleep(0.1)
-            t += 1
+            else:
+                self.timed_step()
+            if self.environment.adjacency_matrix[self.current_location[0]][self.current_location[1]] == 0:
+                raise ValueError("je suis dans un endroit interdit !!!")
+            steps += 1
+            if self.step_delay:
+                time.sleep(self.step_delay)
+        if self.metrics is not None:
+            self.write_episode_metrics("learn", episode, steps, time.perf_counter() - episode_start)
+        return steps, truncated
+
+    def checkpoint_state(self, steps_per_episode, rewards_per_episode, truncated, stable_episodes, previous_path):
+        """
+        Takes a snapshot of the training at the end of an episode (see Checkpoint). The arrays are copies,
+        so that the training can go on while the snapshot is written.
+        :param {list} steps_per_episode: The number of steps of the episodes played so far
+        :param {list} rewards_per_episode: Their returns
+        :param {int} truncated: The number of truncated episodes
+        :param {int} stable_episodes: The number of consecutive episodes the convergence criterion held
+        :param previous_path: The last greedy path of the greedy-path criterion
+        :return: The snapshot: the arrays and a JSON-serializable "state" dict
+        """
+        snapshot = {"grid": self.environment.grid}
+        if self.q_backend == 'dict':
+            snapshot["q"] = ArrayQTable.from_dict(self.Q, self.environment).values
+        else:
+            snapshot["q"] = self.Q.values.copy()
+        if self.visits is not None:
+            snapshot["visits"] = self.visits.counts.copy()
+            snapshot["state_visits"] = self.visits.state_counts.copy()
+        if self.replay is not None:
+            size = len(self.replay)
+            snapshot["replay_states"] = self.replay.states[:size].copy()
+            snapshot["replay_actions"] = self.replay.actions[:size].copy()
+            snapshot["replay_rewards"] = self.replay.rewards[:size].copy()
+            snapshot["replay_next_states"] = self.replay.next_states[:size].copy()
+        snapshot["state"] = {
+            "episode": len(steps_per_episode),
+            "steps": [int(steps) for steps in steps_per_episode],
+            "rewards": [float(reward) for reward in rewards_per_episode],
+            "truncated": int(truncated),
+            "stable_episodes": int(stable_episodes),
+            "previous_path": [[int(i), int(j)] for (i, j) in previous_path] if previous_path is not None else None,
+            "total_steps": int(self.total_steps),
+            "replay_position": int(self.replay.position) if self.replay is not None else 0,
+            "q_backend": self.q_backend,
+            "exploration_rate": float(self.exploration_rate),
+            "temperature": float(self.temperature),
+            "learning_rate": float(self.learning_rate),
+            "rng": self.rng.get_state()
+        }
+        return snapshot
+
+    def resume(self, path):
+        """
+        Restores the training from a checkpoint: the next call of learn continues the interrupted run where it was,
+        and draws the same random numbers as if it had not been interrupted. The agent must be created with the
+        same parameters as the interrupted one (the schedules are functions of the restored step, episode and
+        visit counts), nb_episodes can be raised to extend the run.
+        :param {str} path: A checkpoint file, or a checkpoint directory (its latest checkpoint is used)
+        :return: The number of the last episode of the checkpoint (0 if the directory has no checkpoint yet)
+        """
+        path = latest_checkpoint(path)
+        if path is None:
+            return 0
+        snapshot = load_checkpoint(path)
+        state = snapshot["state"]
+        if not numpy.array_equal(snapshot["grid"], self.environment.grid):
+            raise ValueError("The checkpoint was taken on another labyrinth !")
+        if state["q_backend"] != self.q_backend:
+            raise ValueError("The checkpoint was taken with the " + state["q_backend"] + " Q-table backend !")
+        if (self.visits is not None) != ("visits" in snapshot) or (self.replay is not None) != ("replay_states"
+                                                                                            in snapshot):
+            raise ValueError("The checkpoint was taken with other schedules or planning parameters !")
+
+        if self.q_backend == 'sparse':
+            table = SparseQTable(self.environment, self.sparse_starts())
+            if table.values.shape != snapshot["q"].shape:
+                raise ValueError("The checkpoint was taken with other start cells !")
+            table.values[...] = snapshot["q"]
+        else:
+            table = ArrayQTable.from_array(snapshot["q"], self.environment)
+        self.load_Q(table)
+        if self.visits is not None:
+            self.visits.counts[...] = snapshot["visits"]
+            self.visits.state_counts[...] = snapshot["state_visits"]
+        if self.replay is not None:
+            replay = self.replay
+            size = min(len(snapshot["replay_states"]), replay.capacity)
+            replay.states[:size] = snapshot["replay_states"][:size]
+            replay.actions[:size] = snapshot["replay_actions"][:size]
+            replay.rewards[:size] = snapshot["replay_rewards"][:size]
+            replay.next_states[:size] = snapshot["replay_next_states"][:size]
+            replay.size = size
+            replay.position = state["replay_position"] % replay.capacity if size == replay.capacity else size
+        self.rng.set_state(state["rng"])
+        self.total_steps = state["total_steps"]
+        self.exploration_rate = state["exploration_rate"]
+        self.temperature = state["temperature"]
+        self.learning_rate = state["learning_rate"]
+        self.current_episode = state["episode"]
+        if state["previous_path"] is not None:
+            state["previous_path"] = tuple(tuple(cell) for cell in state["previous_path"])
+        self.resumed_progress = state
+        self.learning_done = False
+        return state["episode"]
+
+    def greedy_path(self, start=None):
+        """
+        Follows the best actions from a cell until the goal.
+        :param start: The first cell of the path (self.start_cell by default)
+        :return: The tuple of the visited cells, or None if the greedy policy does not reach the goal
+        """
+        start = start if start is not None else self.start_cell
+        path = [start]
+        visited = {start}
+        (i, j) = start
+        while not self.environment.is_out(i, j):
+            if not self.environment.get_possible_actions(i, j):
+                return None
+            if self.q_backend != 'dict':
+                action = self.Q.best_action(i, j)
+            else:
+                action = max(self.Q[i][j].items(), key=operator.itemgetter(1))[0]
+            (i, j) = self.environment.move(i, j, action)
+            if (i, j) in visited:
+                return None
+            visited.add((i, j))
+            path.append((i, j))
+        return tuple(path)
+
+    def pick_start(self):
+        """
+        Draws the first cell of a learning episode (see the start parameter of the constructor).
+        :return: The cell (i, j)
+        """
+        if self.start == 'fixed':
+            return self.start_cell
+        candidates = self.environment.start_candidates
+        if self.start == 'uniform':
+            s = candidates[int(self.rng.random() * len(candidates))]
+        else:
+            cumulative = numpy.cumsum(1.0 / (1.0 + self.visits.state_counts[candidates]))
+            index = numpy.searchsorted(cumulative, self.rng.random() * cumulative[-1], side='right')
+            s = candidates[min(index, len(candidates) - 1)]
+        return divmod(int(s), self.environment.width)
 
     def optimal_play(self):
         """
         Plays in the environement by always taking the best action regarding the agent's Q values.
         The agent stops when the property self.stop is set to False.
         """
+        episode = 0
         while not self.stop:
-            self.current_location = (0, 0)
-            self.possible_actions = self.environment.get_possible_actions(*self.current_location)
+            episode += 1
+            self.set_location(self.start_cell)
             self.total_reward = 0.0
+            self.episode_max_delta = 0.0
+            self.reset_episode_metrics()
+            episode_start = time.perf_counter()
+            steps = 0
             while not self.environment.is_out(*self.current_location) and not self.stop:
-                self.action_taken = self.best_action()
-                self.notify_observers()
-                self.current_location = self.environment.get_location(*self.current_location, self.action_taken)
-                self.possible_actions = self.environment.get_possible_actions(*self.current_location)
+                if self.metrics is None:
+                    self.action_taken = self.best_action()
+                    self.throttled_notify()
+                    self.set_location(self.environment.move(*self.current_location, self.action_taken))
+                else:
+                    timings = self.episode_timings
+                    start = time.perf_counter()
+                    self.action_taken = self.best_action()
+                    chosen = time.perf_counter()
+                    self.throttled_notify()
+                    notified = time.perf_counter()
+                    reward = self.environment.get_reward(self.current_location, self.action_taken)
+                    self.total_reward += reward
+                    self.trap_hits += reward == REWARDS[2]
+                    self.set_location(self.environment.move(*self.current_location, self.action_taken))
+                    timings["policy"] += chosen - start
+                    timings["environment"] += time.perf_counter() - notified
                 if self.environment.adjacency_matrix[self.current_location[0]][self.current_location[1]] == 0:
                     raise ValueError("Error: It seems that I am in a forbidden state.")
-                time.sleep(0.1)
+                steps += 1
+                if self.step_delay:
+                    time.sleep(self.step_delay)
+            if self.metrics is not None:
+                if not self.stop:
+                    self.write_episode_metrics("play", episode, steps, time.perf_counter() - episode_start)
+                else:
+                    self.metrics.flush()
+
+    def set_location(self, location):
+        """
+        Moves the agent to a cell, e.g. the first cell of an episode. During an episode, update_state follows
+        the moves without looking the cells up again.
+        :param location: The cell (i, j)
+        """
+        self.current_location = location
+        self.possible_actions = self.environment.get_possible_actions(*location)
+        # index of the cell in the Q values: its row in the sparse backend, its flat state otherwise
+        if self.q_backend == 'sparse':
+            self.current_state = self.Q.state_row(*location)
+        else:
+            self.current_state = self.environment.state_index(*location)
+
+    def timed_step(self):
+        """
+        Takes one learning step (policy, reward, update) and adds the time spent in each phase
+        to self.episode_timings.
+        """
+        timings = self.episode_timings
+        start = time.perf_counter()
+        action = self.policies[self.policy]()
+        chosen = time.perf_counter()
+        reward = self.environment.get_reward(self.current_location, action)
+        rewarded = time.perf_counter()
+        self.action_taken = action
+        # update_state adds the time of the move and of the observers itself, it is left out of the update time
+        inner = timings["environment"] + timings["observer"]
+        self.update_state(action, reward)
+        timings["policy"] += chosen - start
+        timings["environment"] += rewarded - chosen
+        timings["update"] += time.perf_counter() - rewarded - (timings["environment"] + timings["observer"] - inner)
+        self.trap_hits += reward == REWARDS[2]
+
+    def reset_episode_metrics(self):
+        self.episode_timings = dict.fromkeys(TIMED_PHASES, 0.0)
+        self.trap_hits = 0
+
+    def write_episode_metrics(self, phase, episode, steps, wall_time):
+        """
+        Writes the record of an episode to the metrics sink.
+        :param {str} phase: learn|play
+        :param {int} episode: The number of the episode
+        :param {int} steps: The number of steps of the episode
+        :param {float} wall_time: The duration of the episode in seconds (pauses included)
+        """
+        record = {
+            "phase": phase,
+            "episode": episode,
+            "steps": steps,
+            "return": self.total_reward,
+            "trap_hits": self.trap_hits,
+            "max_abs_delta": self.episode_max_delta,
+            "wall_time": wall_time,
+            "steps_per_second": steps / wall_time if wall_time > 0 else 0.0
+        }
+        for phase_name, elapsed in self.episode_timings.items():
+            record[phase_name + "_time"] = elapsed
+        self.metrics.write(record)
 
     def pick_random_action(self):
         """
         Takes a random action.
         :return: A random action
         """
-        random_action = random.choice(self.possible_actions)
+        random_action = self.rng.choice(self.possible_actions)
         return random_action
 
-    def best_action(self):
+    def best_action(self, bonus=0.0):
         """
         Takes the best possible action for the current state.
+        :param {float} bonus: if positive, the actions are compared on Q(s, a) + bonus / sqrt(1 + n(s, a)),
+                              so that the less visited ones are tried first
         :return: The best action
         """
         (i, j) = self.current_location
+        if bonus:
+            counts = self.visits.counts[i * self.environment.width + j].tolist()
+            if self.q_backend != 'dict':
+                row = self.Q.values[i, j] if self.q_backend == 'numpy' else self.Q.values[self.current_state]
+                return ACTIONS[int((row + bonus / numpy.sqrt(numpy.add(counts, 1.0))).argmax())]
+            return max(self.Q[i][j].items(),
+                       key=lambda item: item[1] + bonus / sqrt(counts[ACTION_INDEX[item[0]]] + 1))[0]
+        if self.q_backend != 'dict':
+            # plain floats: numpy calls on a 4-value row cost more than the comparisons themselves
+            k = 4 * self.current_state
+            row = self.Q.flat_values[k:k + 4].tolist()
+            return ACTIONS[row.index(max(row))]
         # The best action is the one that has the maximum Q value
         best_action = max(self.Q[i][j].items(), key=operator.itemgetter(1))[0]
         return best_action
@@ -139,12 +648,37 @@ class Agent:
         with a probability 1-e and a random one with probability e.
         :return: The action that e-greedy has selected.
         """
-        return self.pick_random_action() if random.random() <= self.exploration_rate else self.best_action()
+        if self.exploration_schedule is not None:
+            self.exploration_rate = self.exploration_schedule(self.total_steps, self.current_episode,
+                                                              self.state_visits())
+        if self.rng.random() <= self.exploration_rate:
+            return self.pick_random_action()
+        return self.best_action(self.exploration_bonus)
+
+    def state_visits(self):
+        """
+        :return: The number of visits of the current state
+        """
+        (i, j) = self.current_location
+        return int(self.visits.state_counts[i * self.environment.width + j])
 
     def softmax(self):
-        boltzmann_distribution = self.get_boltzmann_distribution(exponent_function=self.Q)
-        action = self.generate_random(distribution=boltzmann_distribution)
-        return action
+        """
+        The softmax policy takes an action following the Boltzmann distribution of the Q values of the current state.
+        The Q values of the current state change at almost every visit, so its distribution is computed at each step.
+        :return: The action that softmax has selected.
+        """
+        if self.temperature_schedule is not None:
+            self.temperature = self.temperature_schedule(self.total_steps, self.current_episode, self.state_visits())
+        (i, j) = self.current_location
+        if self.q_backend == 'dict':
+            cell = self.Q[i][j]
+            exponents = [cell[a] for a in self.possible_actions]
+        else:
+            k = 4 * self.current_state
+            row = self.Q.flat_values[k:k + 4].tolist()
+            exponents = [row[ACTION_INDEX[a]] for a in self.possible_actions]
+        return self.sample_cumulative(list(itertools.accumulate(self.boltzmann_weights(exponents))))
 
     def update_state(self, action, reward):
         """
@@ -153,35 +687,111 @@ class Agent:
         :param {float} reward: The reward for taking that action.
         """
         self.total_reward += reward
+        self.total_steps += 1
         (i, j) = self.current_location
+        if self.visits is not None:
+            s = i * self.environment.width + j
+            a = ACTION_INDEX[action]
+            self.visits.add(s, a)
+            if self.learning_rate_schedule is not None:
+                self.learning_rate = self.learning_rate_schedule(self.total_steps, self.current_episode,
+                                                                 int(self.visits.counts[s, a]))
         # Get the reached state by taking this action
-        (new_i, new_j) = self.environment.get_location(i, j, action)
-        # We pick the best action of the next state regarding its Q value.
-        q_max = max(self.Q[new_i][new_j].items(), key=operator.itemgetter(1))[1]
-        # Update of the Q value function (A matrix is equivalent to a function in linear algebra).
-        self.Q[i][j][action] += self.learning_rate * (reward + (self.discount_rate * q_max) - self.Q[i][j][action])
+        if self.metrics is None:
+            (new_i, new_j) = self.environment.move(i, j, action)
+        else:
+            start = time.perf_counter()
+            (new_i, new_j) = self.environment.move(i, j, action)
+            self.episode_timings["environment"] += time.perf_counter() - start
+        if self.q_backend != 'dict':
+            # flat indices and plain floats: numpy scalar operations would cost more than the update itself.
+            # The sparse rows of the current and of the reached states are followed, the cells are not looked up.
+            s = self.current_state
+            a = ACTION_INDEX[action]
+            if self.q_backend == 'numpy':
+                new_s = new_i * self.environment.width + new_j
+            else:
+                new_s = self.Q.next_rows.item(s, a)
+            q = self.Q.flat_values
+            q_max = max(q[4 * new_s:4 * new_s + 4].tolist())
+            k = 4 * s + a
+            value = q.item(k)
+            delta = self.learning_rate * (reward + (self.discount_rate * q_max) - value)
+            q[k] = value + delta
+            if self.replay is not None:
+                self.replay.add(s, a, reward, new_s)
+        else:
+            # We pick the best action of the next state regarding its Q value.
+            q_max = max(self.Q[new_i][new_j].items(), key=operator.itemgetter(1))[1]
+            # Update of the Q value function (A matrix is equivalent to a function in linear algebra).
+            delta = self.learning_rate * (reward + (self.discount_rate * q_max) - self.Q[i][j][action])
+            self.Q[i][j][action] += delta
+        if abs(delta) > self.episode_max_delta:
+            self.episode_max_delta = abs(delta)
+        if self.track_changes:
+            self.changed_Q.add((i, j, action))
+        if self.replay is not None:
+            self.plan()
         # We first notify the observers that the agent's state has changed.
-        self.notify_observers()
+        self.throttled_notify()
         # Then we update the next location and actions of the agent.
         self.current_location = (new_i, new_j)
-        self.possible_actions = self.environment.get_possible_actions(*self.current_location)
+        self.possible_actions = self.environment.get_possible_actions(new_i, new_j)
+        self.current_state = new_s if self.q_backend != 'dict' else new_i * self.environment.width + new_j
+
+    def plan(self):
+        """
+        Dyna-Q planning: self.planning_steps Q-learning backups of batches of transitions drawn from the replay buffer.
+        The labyrinth is deterministic, so the stored transitions are an exact model of the environment.
+        """
+        q = self.Q.values.reshape(-1, len(ACTIONS))
+        terminal = self.environment.terminal
+        learning_rate = self.learning_rate
+        for _ in range(self.planning_steps):
+            states, actions, rewards, next_states = self.replay.sample(self.rng.generator, self.planning_batch_size)
+            if self.learning_rate_schedule is not None:
+                learning_rate = self.learning_rate_schedule(self.total_steps, self.current_episode,
+                                                            self.visits.counts[states, actions])
+            # as in Planner, the value of the goal is 0
+            q_max = numpy.where(terminal[next_states], 0.0, q[next_states].max(axis=1))
+            deltas = learning_rate * (rewards + self.discount_rate * q_max - q[states, actions])
+            # a transition drawn twice is updated once (the last assignment wins)
+            q[states, actions] += deltas
+            largest = float(numpy.abs(deltas).max())
+            if largest > self.episode_max_delta:
+                self.episode_max_delta = largest
+            if self.track_changes:
+                width = self.environment.width
+                self.changed_Q.update((s // width, s % width, ACTIONS[a])
+                                      for s, a in zip(states.tolist(), actions.tolist()))
 
     def get_boltzmann_distribution(self, exponent_function):
         """
         Generates a Boltzmann probability distribution with a custom exponent function.
         :param exponent_function: The exponent function.
-        :return: A Boltzmann probability distribution.
+        :return: A Boltzmann probability distribution over self.possible_actions.
         """
         assert self.temperature > 0, "Assertion error: tau must be grater than 0."
 
-        distribution = []
         (i, j) = self.current_location
-        for a in self.possible_actions:
-            denominator = 0.0
-            for b in self.possible_actions:
-                denominator += exp(exponent_function[i][j][b] / self.temperature)
-            distribution.append(exp(exponent_function[i][j][a] / self.temperature) / denominator)
-        return distribution
+        if isinstance(exponent_function, (ArrayQTable, SparseQTable)):
+            exponents = exponent_function.valid_values(i, j).tolist()
+        else:
+            exponents = [exponent_function[i][j][a] for a in self.possible_actions]
+        weights = self.boltzmann_weights(exponents)
+        denominator = sum(weights)
+        return [w / denominator for w in weights]
+
+    def boltzmann_weights(self, exponents):
+        """
+        Unnormalized Boltzmann weights, shared by softmax and get_boltzmann_distribution.
+        The exponents are shifted by their maximum so that exp never overflows, even at low temperatures.
+        :param exponents: The exponents (Q values) of self.possible_actions
+        :return: The list of the weights, the largest one being 1
+        """
+        highest = max(exponents)
+        temperature = self.temperature
+        return [exp((e - highest) / temperature) for e in exponents]
 
     def generate_random(self, distribution):
         """
@@ -189,7 +799,16 @@ class Agent:
         :param distribution: A probability distribution (the sum of proba must be equals to 1)
         :return: A random value from self.possible_actions following a probability distribution
         """
-        return numpy.random.choice(self.possible_actions, p=distribution)
+        return self.sample_cumulative(list(itertools.accumulate(distribution)))
+
+    def sample_cumulative(self, cumulative):
+        """
+        Draws a value from self.possible_actions given its cumulative probability distribution.
+        :param cumulative: The cumulative distribution (cumulative[-1] is the total, close to 1)
+        :return: A random value from self.possible_actions
+        """
+        index = bisect.bisect_right(cumulative, self.rng.random() * cumulative[-1])
+        return self.possible_actions[min(index, len(self.possible_actions) - 1)]
 
     def add_observer(self, observer):
         """
@@ -198,6 +817,28 @@ class Agent:
         """
         self.observers.append(observer)
 
+    def throttled_notify(self):
+        """
+        Notify the observers every self.notify_every steps, at most once every self.notify_interval milliseconds.
+        """
+        if not self.notify_every:
+            return
+        self.steps_since_notification += 1
+        if self.steps_since_notification < self.notify_every:
+            return
+        if self.notify_interval:
+            now = time.perf_counter()
+            if (now - self.last_notification) * 1000 < self.notify_interval:
+                return
+            self.last_notification = now
+        self.steps_since_notification = 0
+        if self.metrics is None:
+            self.notify_observers()
+        else:
+            start = time.perf_counter()
+            self.notify_observers()
+            self.episode_timings["observer"] += time.perf_counter() - start
+
     def notify_observers(self):
         """
         Notify the observers that the state of this agent has changed.
@@ -0,0 +1,194 @@
+import time
+
+import numpy
+
+from Labyrinth import ACTIONS
+from QTable import ArrayQTable
+from RandomStream import RandomStream
+
+
+class BatchTrainer:
+    """
+    Trains K independent Q-learning agents in lock-step. The K Q-tables and the transition tables of
+    the labyrinths are stacked in arrays, so that one step advances every agent with a few NumPy
+    gather/scatter operations instead of K Python-level steps.
+    """
+
+    def __init__(self, policy, environments, nb_episodes, exploration_rate=-1,
+                 temperature=-1, discount_rate=-1, learning_rate=0.9, seed=None, rng=None):
+        """
+        Creates K agents, the k-th one living in environments[k].
+        The hyperparameters are either a single value shared by all agents or a sequence of K values.
+        :param {str} policy: AI of the agents. Possible values: random|e-greedy|softmax
+        :param {list} environments: K instances of Labyrinth.Labyrinth (the same instance may be repeated)
+        :param {int} nb_episodes: Number of episodes for the training of each agent
+        :param exploration_rate: if selected policy is ε-greedy, the exploration rate (in range [0, 1])
+        :param temperature: if selected ai is softmax, the temperature ([0, oo[)
+        :param discount_rate: Discount factor, must be in range [0, 1]
+        :param learning_rate: Learning rate, must be in range [0, 1]
+        :param {int} seed: Seed of the random stream (a fresh one is drawn if None)
+        :param {RandomStream.RandomStream} rng: Random stream of the trainer (takes precedence over seed)
+        """
+        self.nb_agents = len(environments)
+        self.exploration_rate = self._per_agent(exploration_rate)
+        self.temperature = self._per_agent(temperature)
+        self.discount_rate = self._per_agent(discount_rate)
+        self.learning_rate = self._per_agent(learning_rate)
+        if policy not in ('random', 'e-greedy', 'softmax'):
+            raise ValueError("Policy must be random, e-greedy or softmax !")
+        if policy == 'e-greedy' and ((self.exploration_rate <= 0) | (self.exploration_rate > 1)).any():
+            raise ValueError("Exploration rate must be in range [0, 1] if selected policy is ε-greedy !")
+        if policy == 'softmax' and (self.temperature <= 0).any():
+            raise ValueError("Temperature must be in range [0, 1] if selected policy is softmax !")
+        if ((self.discount_rate < 0) | (self.discount_rate > 1)).any():
+            raise ValueError("Discount rate must be in range [0, 1] !")
+        if ((self.learning_rate < 0) | (self.learning_rate > 1)).any():
+            raise ValueError("Learning rate must be in range [0, 1] !")
+
+        self.policy = policy
+        self.nb_episodes = nb_episodes
+        self.environments = environments
+        self.rng = rng if rng is not None else RandomStream(seed)
+
+        # Supported policies, as in Agent.policies
+        self.policies = {
+            'random': self.pick_random_actions,
+            'e-greedy': self.e_greedy,
+            'softmax': self.softmax
+        }
+
+        # The distinct labyrinths are padded to the same number of states and stacked.
+        distinct = []
+        for environment in environments:
+            if all(environment is not other for other in distinct):
+                distinct.append(environment)
+        nb_states = max(environment.height * environment.width for environment in distinct)
+        self.next_state = numpy.zeros((len(distinct), nb_states, len(ACTIONS)), dtype=numpy.intp)
+        self.rewards = numpy.zeros((len(distinct), nb_states, len(ACTIONS)))
+        self.valid = numpy.zeros((len(distinct), nb_states, len(ACTIONS)), dtype=bool)
+        self.terminal = numpy.zeros((len(distinct), nb_states), dtype=bool)
+        for e, environment in enumerate(distinct):
+            size = environment.height * environment.width
+            self.next_state[e, :size] = numpy.maximum(environment.next_state, 0)
+            self.rewards[e, :size] = environment.rewards
+            self.valid[e, :size] = environment.valid
+            self.terminal[e, :size] = environment.terminal
+        self.environment_index = numpy.array([next(e for e, other in enumerate(distinct) if other is environment)
+                                              for environment in environments])
+
+        # Q values: -inf for the impossible actions, as in QTable.ArrayQTable
+        self.Q = numpy.where(self.valid[self.environment_index], 0.0, -numpy.inf)
+        self.agents = numpy.arange(self.nb_agents)
+        self.reset()
+
+    def _per_agent(self, value):
+        values = numpy.broadcast_to(numpy.asarray(value, dtype=float), (self.nb_agents,))
+        return values.copy()
+
+    def reset(self):
+        """
+        Puts every agent back at the start of its first episode (the Q values are kept).
+        """
+        self.current_state = numpy.zeros(self.nb_agents, dtype=numpy.intp)
+        self.current_episode = numpy.zeros(self.nb_agents, dtype=numpy.intp)
+        self.active = numpy.ones(self.nb_agents, dtype=bool)
+        self.episode_steps = numpy.zeros(self.nb_agents, dtype=numpy.intp)
+        self.episode_reward = numpy.zeros(self.nb_agents)
+        self.steps = numpy.zeros((self.nb_agents, self.nb_episodes), dtype=numpy.intp)
+        self.total_rewards = numpy.zeros((self.nb_agents, self.nb_episodes))
+
+    def train(self, max_steps=None):
+        """
+        Trains all the agents until each of them has played nb_episodes episodes.
+        :param {int} max_steps: If given, stops after this number of lock-step steps
+        :return: A training summary: steps and total reward per episode ((K, nb_episodes) arrays), wall time
+        """
+        start_time = time.perf_counter()
+        nb_steps = 0
+        while self.active.any() and (max_steps is None or nb_steps < max_steps):
+            self.step()
+            nb_steps += 1
+        return {
+            "episodes": self.current_episode.copy(),
+            "steps": self.steps,
+            "rewards": self.total_rewards,
+            "wall_time": time.perf_counter() - start_time
+        }
+
+    def step(self):
+        """
+        Advances every active agent by one Q-learning step.
+        """
+        agents = self.agents[self.active]
+        environments = self.environment_index[agents]
+        states = self.current_state[agents]
+        q = self.Q[agents, states]
+        valid = self.valid[environments, states]
+
+        actions = self.policies[self.policy](agents, q, valid)
+
+        rewards = self.rewards[environments, states, actions]
+        next_states = self.next_state[environments, states, actions]
+        # Same update rule as Agent.update_state
+        q_max = self.Q[agents, next_states].max(axis=1)
+        learning_rate = self.learning_rate[agents]
+        self.Q[agents, states, actions] += learning_rate * (rewards + self.discount_rate[agents] * q_max
+                                                            - self.Q[agents, states, actions])
+
+        self.current_state[agents] = next_states
+        self.episode_steps[agents] += 1
+        self.episode_reward[agents] += rewards
+
+        done = agents[self.terminal[environments, next_states]]
+        if done.size:
+            episodes = self.current_episode[done]
+            self.steps[done, episodes] = self.episode_steps[done]
+            self.total_rewards[done, episodes] = self.episode_reward[done]
+            self.current_episode[done] += 1
+            self.current_state[done] = 0
+            self.episode_steps[done] = 0
+            self.episode_reward[done] = 0.0
+            self.active[done] = self.current_episode[done] < self.nb_episodes
+
+    def pick_random_actions(self, agents, q, valid):
+        """
+        :return: A uniformly random possible action for each agent
+        """
+        nb_valid = valid.sum(axis=1)
+        picks = (self.rng.generator.random(len(agents)) * nb_valid).astype(numpy.intp)
+        # index of the (picks + 1)-th possible action
+        return (valid.cumsum(axis=1) <= picks[:, None]).sum(axis=1)
+
+    def e_greedy(self, agents, q, valid):
+        """
+        :return: The best action with probability 1-e, a random one with probability e, for each agent
+        """
+        explore = self.rng.generator.random(len(agents)) <= self.exploration_rate[agents]
+        return numpy.where(explore, self.pick_random_actions(agents, q, valid), q.argmax(axis=1))
+
+    def softmax(self, agents, q, valid):
+        """
+        :return: An action drawn from the Boltzmann distribution of the Q values, for each agent
+        """
+        logits = q / self.temperature[agents, None]
+        weights = numpy.exp(logits - logits.max(axis=1, keepdims=True))
+        cumulative = weights.cumsum(axis=1)
+        thresholds = self.rng.generator.random(len(agents)) * cumulative[:, -1]
+        actions = (cumulative <= thresholds[:, None]).sum(axis=1)
+        # guards against rounding errors on the last possible action
+        return numpy.where(valid[numpy.arange(len(agents)), numpy.minimum(actions, len(ACTIONS) - 1)],
+                           numpy.minimum(actions, len(ACTIONS) - 1), q.argmax(axis=1))
+
+    def export_Q(self, k):
+        """
+        :return: The Q values of the k-th agent in the nested list-of-dicts layout used by the JSON models.
+        """
+        return self.q_table(k).to_dict()
+
+    def q_table(self, k):
+        """
+        :return: The Q values of the k-th agent as a QTable.ArrayQTable
+        """
+        environment = self.environments[k]
+        size = environment.height * environment.width
+        return ArrayQTable.from_array(self.Q[k, :size], environment)
@@ -0,0 +1,373 @@
+"""
+Benchmark suite: speed and learning quality of Labyrinth, Agent and ModelIO on the shipped maps
+and on generated mazes of growing size (see MapGenerator).
+
+Every measure is the best of several repetitions, each long enough (an inner loop of many calls) for the
+timer. The speed of a machine also drifts over seconds, far more than between two repetitions, so the whole
+suite is run several rounds: a measure keeps its best value over the rounds and its spread, the relative gap
+between its median and its best value, an estimate of the noise. The results are saved in JSON with the
+machine they were measured on, and can be compared with a baseline saved the same way: a measure that got
+worse by more than both the tolerance and the noise of the two measures is reported as a regression (and makes
+the exit status 1). The measures of the baseline missing from the results are listed as well.
+
+Example:
+    python Benchmark.py --output bench.json --save-baseline baseline.json
+    python Benchmark.py --baseline baseline.json --tolerance 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+
+import MapGenerator
+import ModelIO
+import Planner
+from Agent import Agent
+from Labyrinth import ACTIONS, Labyrinth
+
+SHIPPED_MAPS = ["Default.map", "Lab1.map", "Lab2.map", "Lab3.map"]
+GENERATED_SIZES = [10, 100, 1000]
+POLICIES = {
+    "random": {},
+    "e-greedy": {"exploration_rate": 0.3},
+    "softmax": {"temperature": 4}
+}
+
+
+def machine_info():
+    """
+    :return: A description of the machine and of the versions of Python and NumPy
+    """
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__
+    }
+
+
+def best_time(function, repeat=5, number=None, min_time=0.02):
+    """
+    Times repeat runs of number calls of function.
+    :param {int} number: Calls per run (default: enough for a run to last min_time seconds)
+    :return: (shortest duration of one call in seconds, spread of the runs, see spread)
+    """
+    if number is None:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                function()
+            if time.perf_counter() - start >= min_time:
+                break
+            number *= 2
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        durations.append((time.perf_counter() - start) / number)
+    return min(durations), spread(durations)
+
+
+def spread(values, higher_is_better=False):
+    """
+    :return: The relative gap between the median and the best of the values (0 for a single one). Unlike the
+             range, it is not inflated by a single hiccup of the machine.
+    """
+    values = sorted(values, reverse=higher_is_better)
+    (best, median) = (values[0], values[len(values) // 2])
+    # for a rate, the same gap as between the durations 1 / value
+    return abs(best - median) / abs(median if higher_is_better else best) if best and median else 0.0
+
+
+def transitions(environment, count, seed=0):
+    """
+    :return: count random (i, j, action) with a possible action, outside of the goal
+    """
+    states, actions = numpy.nonzero(environment.valid & ~environment.terminal[:, None])
+    picks = numpy.random.default_rng(seed).integers(len(states), size=count)
+    return [(int(s) // environment.width, int(s) % environment.width, ACTIONS[a])
+            for s, a in zip(states[picks].tolist(), actions[picks].tolist())]
+
+
+def bench_update_state(environment, q_backend, count=10000, repeat=5):
+    """
+    :return: (latency in seconds per call of Agent.update_state, spread)
+    """
+    agent = Agent("random", environment, 1, discount_rate=0.5, learning_rate=0.5, headless=True,
+                  q_backend=q_backend, seed=0)
+    steps = []
+    for i, j, action in transitions(environment, count):
+        # the index of the cell in the Q values is looked up once, out of the timed loop
+        agent.set_location((i, j))
+        steps.append(((i, j), agent.current_state, action, environment.get_reward((i, j), action)))
+
+    def run():
+        for location, state, action, reward in steps:
+            agent.current_location = location
+            agent.current_state = state
+            agent.update_state(action, reward)
+    (best, noise) = best_time(run, repeat)
+    return best / count, noise
+
+
+def bench_policy(environment, policy, q_backend, count=10000, repeat=5):
+    """
+    :return: (latency in seconds per call of a policy, spread), in random cells. As during the training,
+             the Q values of a cell are updated between two selections (the update is not timed).
+    """
+    agent = Agent(policy, environment, 1, discount_rate=0.5, learning_rate=0.5, headless=True, q_backend=q_backend,
+                  seed=0, **POLICIES[policy])
+    steps = transitions(environment, count)
+    locations = [(i, j) for i, j, _ in steps]
+    select = agent.policies[policy]
+
+    def run():
+        elapsed = 0.0
+        for location, (_, _, action) in zip(locations, steps):
+            agent.set_location(location)
+            start = time.perf_counter()
+            select()
+            elapsed += time.perf_counter() - start
+            agent.update_state(action, environment.get_reward(location, action))
+        return elapsed
+
+    durations = [run() for _ in range(repeat)]
+    return min(durations) / count, spread(durations)
+
+
+def bench_learn(environment, policy, q_backend, nb_episodes, repeat=3, **kwargs):
+    """
+    :return: (episodes per second, steps per second, mean reward of the last 10% of the episodes, spread of
+             the step times)
+    """
+    best = None
+    step_times = []
+    for _ in range(repeat):
+        agent = Agent(policy, environment, nb_episodes, discount_rate=0.5, learning_rate=0.5, headless=True,
+                      q_backend=q_backend, seed=0, **dict(POLICIES[policy], **kwargs))
+        summary = agent.learn()
+        step_times.append(summary["wall_time"] / max(1, sum(summary["steps"])))
+        if best is None or summary["wall_time"] < best["wall_time"]:
+            best = summary
+    tail = best["rewards"][-max(1, len(best["rewards"]) // 10):]
+    return (best["episodes"] / best["wall_time"], sum(best["steps"]) / best["wall_time"],
+            sum(tail) / len(tail), spread(step_times))
+
+
+def bench_environment(environment, count=10000, repeat=5):
+    """
+    :return: {query: (latency in seconds per call, spread)} for each query of Labyrinth. The queries take well
+             under a microsecond: each run loops over the count cells as many times as needed to last long enough
+             (see best_time).
+    """
+    steps = transitions(environment, count)
+    cells = [(i, j) for i, j, _ in steps]
+    queries = {
+        "get_possible_actions": lambda: [environment.get_possible_actions(i, j) for i, j in cells],
+        "get_reward": lambda: [environment.get_reward((i, j), action) for i, j, action in steps],
+        "move": lambda: [environment.move(i, j, action) for i, j, action in steps],
+        "is_out": lambda: [environment.is_out(i, j) for i, j in cells]
+    }
+    latencies = {}
+    for name, query in queries.items():
+        (best, noise) = best_time(query, repeat)
+        latencies[name] = (best / count, noise)
+    return latencies
+
+
+def bench_model_io(environment, q_values, extension, repeat=3):
+    """
+    :return: ((save time, spread), (load time, spread)) in seconds of a model in the .json or .qmodel format
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "model" + extension)
+        save = best_time(lambda: ModelIO.save_model(path, q_values, environment), repeat)
+        load = best_time(lambda: ModelIO.load_model(path, mmap=False), repeat)
+    return save, load
+
+
+def run_suite(maps=SHIPPED_MAPS, sizes=GENERATED_SIZES, quick=False, rounds=None):
+    """
+    Runs every workload, rounds times.
+    :param {list} maps: The shipped maps
+    :param {list} sizes: The sizes of the generated maps
+    :param {bool} quick: Fewer repetitions, rounds and episodes
+    :param {int} rounds: Number of runs of the whole suite (default: 5, 7 if not quick)
+    :return: {name of the measure: {"value", "unit", "higher_is_better", "spread"}}, the value being the best
+             of the rounds and the spread the one of the rounds
+    """
+    rounds = rounds or (5 if quick else 7)
+    measures = [run_round(maps, sizes, quick) for _ in range(rounds)]
+    results = {}
+    for name, measure in measures[0].items():
+        values = [round_measures[name]["value"] for round_measures in measures]
+        # the spread of the repetitions of a round only stands for the noise if there is a single round
+        noise = spread(values, measure["higher_is_better"]) if rounds > 1 else measure["spread"]
+        results[name] = dict(measure, value=max(values) if measure["higher_is_better"] else min(values),
+                             spread=noise)
+    return results
+
+
+def run_round(maps, sizes, quick):
+    """
+    Runs every workload once.
+    :return: The measures (see run_suite)
+    """
+    results = {}
+    repeat = 3 if quick else 5
+    nb_episodes = 50 if quick else 200
+
+    def record(name, value, unit, higher_is_better=False, spread=0.0):
+        results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better, "spread": spread}
+
+    def record_time(name, timing):
+        (seconds, noise) = timing
+        record(name, seconds, "s", spread=noise)
+
+    for map_file in maps:
+        name = os.path.splitext(os.path.basename(map_file))[0]
+        environment = Labyrinth.from_file(map_file)
+        for q_backend in ("dict", "numpy"):
+            record_time("%s/update_state/%s" % (name, q_backend), bench_update_state(environment, q_backend,
+                                                                                     repeat=repeat))
+            latencies = {}
+            for policy in POLICIES:
+                latencies[policy] = bench_policy(environment, policy, q_backend, repeat=repeat)
+                record_time("%s/policy/%s/%s" % (name, policy, q_backend), latencies[policy])
+            record("%s/policy/softmax_vs_e-greedy/%s" % (name, q_backend),
+                   latencies["softmax"][0] / latencies["e-greedy"][0], "ratio",
+                   spread=latencies["softmax"][1] + latencies["e-greedy"][1])
+        learned = {}
+        for policy in POLICIES:
+            learned[policy] = bench_learn(environment, policy, "dict", nb_episodes, repeat=max(1, repeat - 2))
+            (episodes, steps, reward, noise) = learned[policy]
+            record("%s/learn/%s/episodes_per_second" % (name, policy), episodes, "episodes/s", True, noise)
+            record("%s/learn/%s/steps_per_second" % (name, policy), steps, "steps/s", True, noise)
+            record("%s/learn/%s/final_reward" % (name, policy), reward, "reward", True)
+        # cost of a softmax learning step relative to an e-greedy one
+        record("%s/learn/softmax_vs_e-greedy/step_time_ratio" % name,
+               learned["e-greedy"][1] / learned["softmax"][1], "ratio",
+               spread=learned["e-greedy"][3] + learned["softmax"][3])
+        for query, timing in bench_environment(environment, repeat=repeat).items():
+            record_time("%s/environment/%s" % (name, query), timing)
+        q_values = Planner.solve(environment, 0.5)
+        save, load = bench_model_io(environment, q_values.to_dict(), ".json", repeat)
+        record_time("%s/json/export" % name, save)
+        record_time("%s/json/import" % name, load)
+
+    for size in sizes:
+        name = "generated_%dx%d" % (size, size)
+        grid = MapGenerator.generate(size, size, seed=0, style="maze", loops=0.1)
+        record_time(name + "/compile", best_time(lambda: Labyrinth(grid), max(1, repeat - 2)))
+        environment = Labyrinth(grid)
+        for query, timing in bench_environment(environment, repeat=repeat).items():
+            record_time("%s/environment/%s" % (name, query), timing)
+        record_time(name + "/update_state/numpy", bench_update_state(environment, "numpy", repeat=repeat))
+        # the large maps are not solved within a few episodes: the training is cut by a time budget
+        _, steps, _, noise = bench_learn(environment, "e-greedy", "numpy", 10 ** 6, repeat=1,
+                                         time_budget=0.5 if quick else 2.0)
+        record(name + "/learn/e-greedy/steps_per_second", steps, "steps/s", True, noise)
+        q_values = Planner.solve(environment, 0.5, max_iterations=1000)
+        save, load = bench_model_io(environment, q_values, ModelIO.BINARY_EXTENSION, max(1, repeat - 2))
+        record_time(name + "/binary/export", save)
+        record_time(name + "/binary/import", load)
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares results with a baseline. A change is only significant if it is larger than both the tolerance and
+    the noise of the two measures (the sum of their spreads): the sub-microsecond latencies vary a lot more
+    than 10% from one run to the next on a busy machine.
+    :param {dict} results: The measures (see run_suite)
+    :param {dict} baseline: The measures of the baseline
+    :param {float} tolerance: Relative change under which a measure is considered unchanged
+    :return: A list of (name, baseline value, value, relative change, noise, status), status being
+             regression|improvement|unchanged|new|missing (missing: measured in the baseline only).
+             A positive change is always an improvement.
+    """
+    rows = []
+    for name, measure in sorted(results.items()):
+        if name not in baseline:
+            rows.append((name, None, measure["value"], None, measure.get("spread", 0.0), "new"))
+            continue
+        reference = baseline[name]["value"]
+        change = (measure["value"] - reference) / abs(reference) if reference else 0.0
+        if not measure["higher_is_better"]:
+            change = -change
+        noise = measure.get("spread", 0.0) + baseline[name].get("spread", 0.0)
+        threshold = max(tolerance, noise)
+        if change < -threshold:
+            status = "regression"
+        elif change > threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+        rows.append((name, reference, measure["value"], change, noise, status))
+    for name in sorted(set(baseline) - set(results)):
+        rows.append((name, baseline[name]["value"], None, None, baseline[name].get("spread", 0.0), "missing"))
+    return rows
+
+
+def report(rows):
+    """
+    :return: The comparison as a text table, regressions first
+    """
+    order = {"regression": 0, "missing": 1, "improvement": 2, "new": 3, "unchanged": 4}
+    lines = ["%-55s %12s %12s %9s %8s  %s" % ("measure", "baseline", "current", "change", "noise", "status")]
+    for name, reference, value, change, noise, status in sorted(rows, key=lambda row: (order[row[5]], row[0])):
+        lines.append("%-55s %12s %12s %9s %7.1f%%  %s" % (name, "-" if reference is None else "%.4g" % reference,
+                                                          "-" if value is None else "%.4g" % value,
+                                                          "-" if change is None else "%+.1f%%" % (100 * change),
+                                                          100 * noise, status))
+    counts = {status: sum(1 for row in rows if row[5] == status) for status in order}
+    lines.append("%(regression)d regressions, %(improvement)d improvements, %(unchanged)d unchanged, %(new)d new, "
+                 "%(missing)d missing" % counts)
+    return "\n".join(lines)
+
+
+def save_results(path, results):
+    with open(path, 'w') as outfile:
+        json.dump({"machine": machine_info(), "results": results}, outfile, sort_keys=True, indent=4)
+
+
+def load_results(path):
+    with open(path, 'r') as infile:
+        return json.load(infile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the labyrinth, the agent and the model files.")
+    parser.add_argument("--maps", nargs="*", default=SHIPPED_MAPS, help=".map or .npy files")
+    parser.add_argument("--sizes", nargs="*", type=int, default=GENERATED_SIZES, help="sizes of the generated maps")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions, rounds and episodes")
+    parser.add_argument("--rounds", type=int, default=None, help="runs of the whole suite (default: 5, 7)")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare with")
+    parser.add_argument("--save-baseline", default=None, help="also saves the results as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change considered as noise (at least, see compare)")
+    args = parser.parse_args()
+
+    results = run_suite(args.maps, args.sizes, args.quick, args.rounds)
+    for path in (args.output, args.save_baseline):
+        if path is not None:
+            save_results(path, results)
+    if args.baseline is None:
+        print("\n".join("%-55s %12.4g %s" % (name, measure["value"], measure["unit"])
+                        for name, measure in sorted(results.items())))
+        sys.exit(0)
+    baseline = load_results(args.baseline)
+    if baseline["machine"] != machine_info():
+        print("warning: the baseline was measured on another machine: " + json.dumps(baseline["machine"]))
+    rows = compare(results, baseline["results"], args.tolerance)
+    print(report(rows))
+    sys.exit(1 if any(row[5] == "regression" for row in rows) else 0)
@@ -0,0 +1,166 @@
+"""
+Checkpoints of the training of an Agent, to resume a long run after a crash.
+
+A checkpoint is a .npz file named checkpoint_<episode>.npz holding:
+    - "q": the Q values (the (height, width, 4) array, or the (n_states, 4) array of the sparse backend)
+    - "grid": the map, to check that a checkpoint is resumed on the same labyrinth
+    - "visits", "state_visits": the visit counts of the schedules (if the agent counts visits)
+    - "replay_*": the transitions of the replay buffer (if the agent plans)
+    - "state": a JSON string: number of the last episode, steps and returns of the episodes so far, early stopping
+      state, current hyperparameters and state of the random stream (see Agent.checkpoint_state)
+
+The agent takes a snapshot (a copy of its arrays) at the end of an episode and a background thread writes it:
+the training only waits if the previous checkpoint is still being written. Each file is written under a temporary
+name then renamed, so a crash never leaves a truncated checkpoint, and only the last keep checkpoints are kept.
+
+Example:
+    agent = Agent("e-greedy", labyrinth, 100000, 0.3, discount_rate=0.9, headless=True, q_backend="numpy",
+                  checkpointer=Checkpointer("run1", every_episodes=1000, keep=3))
+    agent.resume("run1")   # if the run was interrupted
+    agent.learn()
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy
+
+PATTERN = re.compile(r"^checkpoint_(\d+)\.npz$")
+
+
+def checkpoint_path(directory, episode):
+    return os.path.join(directory, "checkpoint_%09d.npz" % episode)
+
+
+def list_checkpoints(directory):
+    """
+    :param {str} directory: A checkpoint directory
+    :return: The paths of its checkpoints, from the oldest to the latest
+    """
+    if not os.path.isdir(directory):
+        return []
+    episodes = sorted(int(match.group(1)) for match in map(PATTERN.match, os.listdir(directory)) if match)
+    return [checkpoint_path(directory, episode) for episode in episodes]
+
+
+def latest_checkpoint(path):
+    """
+    :param {str} path: A checkpoint file or directory
+    :return: The path of the checkpoint, the latest one of a directory (None if it has none)
+    """
+    if not os.path.isdir(path):
+        return path if os.path.isfile(path) else None
+    checkpoints = list_checkpoints(path)
+    return checkpoints[-1] if checkpoints else None
+
+
+def write_checkpoint(path, snapshot):
+    """
+    Writes a checkpoint atomically: the file is written and synced under a temporary name, then renamed.
+    :param {str} path: The path of the .npz file
+    :param {dict} snapshot: The arrays and the JSON-serializable "state" dict
+    """
+    arrays = {name: value for name, value in snapshot.items() if name != "state"}
+    arrays["state"] = numpy.array(json.dumps(snapshot["state"]))
+    temporary = path + ".tmp"
+    with open(temporary, 'wb') as outfile:
+        numpy.savez(outfile, **arrays)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """
+    :param {str} path: The path of a .npz checkpoint
+    :return: The snapshot: the arrays and the "state" dict
+    """
+    with numpy.load(path) as archive:
+        snapshot = {name: archive[name] for name in archive.files}
+    snapshot["state"] = json.loads(str(snapshot["state"]))
+    return snapshot
+
+
+class Checkpointer:
+    """
+    Decides when an agent takes a checkpoint and writes the checkpoints in a background thread.
+    """
+
+    def __init__(self, directory, every_episodes=100, every_seconds=None, keep=3):
+        """
+        :param {str} directory: The directory of the checkpoints (created if needed)
+        :param {int} every_episodes: a checkpoint is taken every every_episodes episodes (None: never by count)
+        :param {float} every_seconds: a checkpoint is also taken when every_seconds seconds passed since the last one
+        :param {int} keep: Number of checkpoints kept, the older ones are deleted
+        """
+        if every_episodes is not None and every_episodes < 1:
+            raise ValueError("Checkpoint period must be at least one episode !")
+        if every_seconds is not None and every_seconds <= 0:
+            raise ValueError("Checkpoint interval must be positive !")
+        if keep < 1:
+            raise ValueError("At least one checkpoint must be kept !")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every_episodes = every_episodes
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.last_checkpoint = time.perf_counter()
+        self.last_path = None
+        self.error = None
+        # one pending snapshot at most: the training waits for the writer rather than piling copies of Q up
+        self.queue = queue.Queue(maxsize=1)
+        self.writer = None
+
+    def due(self, episode):
+        """
+        :param {int} episode: The number of the episode that just ended
+        :return: True if a checkpoint must be taken
+        """
+        if self.every_episodes is not None and episode % self.every_episodes == 0:
+            return True
+        return self.every_seconds is not None and time.perf_counter() - self.last_checkpoint >= self.every_seconds
+
+    def save(self, snapshot):
+        """
+        Queues a snapshot (see Agent.checkpoint_state) for the background writer.
+        The arrays of the snapshot must not be modified afterwards.
+        """
+        self.raise_error()
+        if self.writer is None or not self.writer.is_alive():
+            self.writer = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+            self.writer.start()
+        self.last_checkpoint = time.perf_counter()
+        self.queue.put(snapshot)
+
+    def wait(self):
+        """
+        Waits until the queued checkpoints are written.
+        """
+        self.queue.join()
+        self.raise_error()
+
+    def raise_error(self):
+        """
+        Raises the error of the writer thread, if a checkpoint could not be written.
+        """
+        if self.error is not None:
+            (error, self.error) = (self.error, None)
+            raise error
+
+    def _write_loop(self):
+        while True:
+            snapshot = self.queue.get()
+            try:
+                path = checkpoint_path(self.directory, snapshot["state"]["episode"])
+                write_checkpoint(path, snapshot)
+                self.last_path = path
+                for old in list_checkpoints(self.directory)[:-self.keep]:
+                    os.remove(old)
+            except Exception as error:
+                # any failure (disk, unserializable state...) is raised in the training thread by save or wait
+                self.error = error
+            finally:
+                self.queue.task_done()
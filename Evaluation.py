@@ -0,0 +1,146 @@
+"""
+Evaluation of trained Q values without the GUI: the greedy policy is extracted with one argmax over the whole
+Q array, then followed from (0, 0) on the lookup tables of Labyrinth.Labyrinth until the goal, a cycle or a
+cell without possible action.
+
+Example:
+    python Evaluation.py Lab*_*.json --output evaluation.csv
+"""
+import argparse
+import csv
+import os
+from multiprocessing import Pool
+
+import numpy
+
+import ModelIO
+from Labyrinth import ACTIONS, REWARDS, Labyrinth
+from QTable import ArrayQTable
+
+RESULT_FIELDS = ["model", "reached_goal", "end", "steps", "return", "trap_hits"]
+
+# Labyrinths already compiled by this process, by map
+_labyrinths = {}
+
+
+def greedy_policy(q_values, environment):
+    """
+    :param q_values: Q values as a QTable.ArrayQTable, a (height, width, 4) array or in the nested list-of-dicts
+                     layout
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :return: The (height * width,) int8 array of the index of the best action of each state
+             (-1 in the goal and in the cells without possible action)
+    """
+    q = ModelIO.q_array(q_values, environment).reshape(-1, len(ACTIONS))
+    q = numpy.where(environment.valid, q, -numpy.inf)
+    policy = q.argmax(axis=1).astype(numpy.int8)
+    policy[environment.terminal | ~environment.valid.any(axis=1)] = -1
+    return policy
+
+
+def rollout(environment, policy, start=(0, 0), max_steps=None):
+    """
+    Follows a greedy policy.
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :param policy: The greedy policy (see greedy_policy)
+    :param start: The first cell
+    :param {int} max_steps: Maximum number of steps (no limit by default: a deterministic policy either reaches
+                            the goal or a cycle in less steps than there are cells)
+    :return: A dict with the number of steps, the return, the number of traps hit, whether the goal was reached
+             and the reason of the end of the rollout (goal|cycle|dead_end|max_steps)
+    """
+    s = environment.state_index(*start)
+    visited = {s}
+    steps = 0
+    total_reward = 0.0
+    trap_hits = 0
+    end = "goal"
+    while not environment.terminal[s]:
+        if steps == max_steps:
+            end = "max_steps"
+            break
+        a = policy[s]
+        if a < 0:
+            end = "dead_end"
+            break
+        reward = environment.rewards[s, a]
+        total_reward += reward
+        trap_hits += reward == REWARDS[2]
+        s = environment.next_state[s, a]
+        steps += 1
+        if s in visited:
+            end = "cycle"
+            break
+        visited.add(s)
+    return {"reached_goal": end == "goal", "end": end, "steps": steps, "return": float(total_reward),
+            "trap_hits": int(trap_hits)}
+
+
+def evaluate(q_values, environment, start=(0, 0), max_steps=None):
+    """
+    :return: The rollout (see rollout) of the greedy policy of Q values
+    """
+    return rollout(environment, greedy_policy(q_values, environment), start, max_steps)
+
+
+def labyrinth_of(grid):
+    """
+    Compiles a map once per process.
+    :param grid: A (height, width) int8 array
+    :return: A Labyrinth.Labyrinth
+    """
+    key = (grid.shape, grid.tobytes())
+    if key not in _labyrinths:
+        _labyrinths[key] = Labyrinth(numpy.array(grid))
+    return _labyrinths[key]
+
+
+def evaluate_model(path, start=(0, 0), max_steps=None):
+    """
+    Evaluates a saved model (.json or .qmodel) on its own labyrinth.
+    :return: The rollout of its greedy policy, with the path of the model
+    """
+    model = ModelIO.load_model(path)
+    environment = labyrinth_of(model["labyrinth"])
+    result = evaluate(ArrayQTable.from_array(model["q_values"], environment, copy=False), environment, start,
+                      max_steps)
+    result["model"] = path
+    return result
+
+
+def _evaluate_job(job):
+    return evaluate_model(*job)
+
+
+def evaluate_models(paths, start=(0, 0), max_steps=None, workers=1):
+    """
+    Evaluates many saved models. The labyrinths shared by several models are compiled once.
+    :param {list} paths: The paths of the models
+    :param {int} workers: Number of processes (None: number of cores)
+    :return: The list of the results (see evaluate_model), in the order of paths
+    """
+    jobs = [(path, start, max_steps) for path in paths]
+    if workers == 1:
+        return [_evaluate_job(job) for job in jobs]
+    with Pool(workers) as pool:
+        return pool.map(_evaluate_job, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count()))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluates the greedy policy of saved models.")
+    parser.add_argument("models", nargs="+", help=".json or .qmodel files")
+    parser.add_argument("--max-steps", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=1, help="number of processes (0: all cores)")
+    parser.add_argument("--output", default=None, help="CSV file of the results")
+    args = parser.parse_args()
+
+    results = evaluate_models(args.models, max_steps=args.max_steps, workers=args.workers or None)
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    for result in results:
+        print("%-40s %-5s %-9s %5d steps  return %8.1f  %d traps"
+              % (result["model"], result["reached_goal"], result["end"], result["steps"], result["return"],
+                 result["trap_hits"]))
@@ -0,0 +1,232 @@
+import math
+import tkinter as tk
+
+import numpy
+
+import ModelIO
+from Labyrinth import ACTION_INDEX, ACTIONS, MOVES
+
+# colours of the cells (RGB)
+ROCK_COLOUR = (20, 28, 36)
+TRAP_COLOUR = (192, 57, 43)
+GOAL_COLOUR = (39, 174, 96)
+# the free cells are coloured from LOW_COLOUR (lowest max-Q of the map) to HIGH_COLOUR (highest max-Q)
+LOW_COLOUR = (52, 73, 94)
+HIGH_COLOUR = (241, 196, 15)
+
+
+def heatmap_rgb(grid, q_values, step=1, repeat=1):
+    """
+    Builds the image of a region of the labyrinth: a heatmap of the max-Q of the free cells, rocks, traps and goal.
+    :param grid: The (rows, columns) int8 region of the map
+    :param q_values: The (rows, columns, 4) region of the Q values (-inf for the impossible actions)
+    :param {int} step: One cell out of step is drawn in each direction (zoomed out)
+    :param {int} repeat: Each drawn cell is repeat x repeat pixels (zoomed in)
+    :return: A (height, width, 3) uint8 array
+    """
+    grid = grid[::step, ::step]
+    best = q_values[::step, ::step].max(axis=2)
+    finite = numpy.isfinite(best)
+    if finite.any():
+        (low, high) = (best[finite].min(), best[finite].max())
+    else:
+        (low, high) = (0.0, 0.0)
+    ratio = (best - low) / (high - low) if high > low else numpy.full(best.shape, 0.5)
+    ratio = numpy.where(finite, ratio, 0.0)[..., None]
+    rgb = (numpy.array(LOW_COLOUR) * (1 - ratio) + numpy.array(HIGH_COLOUR) * ratio).astype(numpy.uint8)
+    rgb[grid == 0] = ROCK_COLOUR
+    rgb[grid == 2] = TRAP_COLOUR
+    rgb[grid == -1] = GOAL_COLOUR
+    if repeat > 1:
+        rgb = rgb.repeat(repeat, axis=0).repeat(repeat, axis=1)
+    return rgb
+
+
+def ppm_data(rgb):
+    """
+    :param rgb: A (height, width, 3) uint8 array
+    :return: The image in the binary PPM format, as accepted by tk.PhotoImage(data=...)
+    """
+    (height, width, _) = rgb.shape
+    return b"P6 %d %d 255\n" % (width, height) + numpy.ascontiguousarray(rgb).tobytes()
+
+
+class HeatmapView:
+    """
+    Level-of-detail view of a large labyrinth on a canvas. The visible region is drawn as a single image
+    (max-Q heatmap); the greedy policy is drawn as arrows and the Q values as numbers only when the cells
+    are large enough. The view can be zoomed with the mouse wheel and panned by dragging.
+    """
+
+    def __init__(self, canvas, labyrinth, q_values, width=640, height=640, arrows_zoom=12, numbers_zoom=64):
+        """
+        :param canvas: The tkinter canvas to draw on
+        :param {Labyrinth.Labyrinth} labyrinth: The labyrinth
+        :param q_values: The Q values of the agent (QTable.ArrayQTable or nested list-of-dicts layout)
+        :param {int} width: Width of the viewport in pixels
+        :param {int} height: Height of the viewport in pixels
+        :param {int} arrows_zoom: Minimum cell size (in pixels) to draw the greedy policy arrows
+        :param {int} numbers_zoom: Minimum cell size (in pixels) to draw the Q values
+        """
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        self.arrows_zoom = arrows_zoom
+        self.numbers_zoom = numbers_zoom
+        self.image = None
+        self.image_item = self.canvas.create_image(0, 0, anchor='nw')
+        self.overlay_items = []
+        self.agent_item = self.canvas.create_oval(0, 0, 0, 0, fill="white", outline="black")
+        self.agent_location = (0, 0)
+        self.drag_start = None
+        self.reset(labyrinth, q_values)
+
+        self.canvas.bind("<MouseWheel>", lambda event: self.zoom(1.25 if event.delta > 0 else 0.8, event.x, event.y))
+        self.canvas.bind("<Button-4>", lambda event: self.zoom(1.25, event.x, event.y))
+        self.canvas.bind("<Button-5>", lambda event: self.zoom(0.8, event.x, event.y))
+        self.canvas.bind("<ButtonPress-1>", self.start_drag)
+        self.canvas.bind("<B1-Motion>", self.drag)
+
+    def destroy(self):
+        """
+        Removes the items and the bindings of this view from the canvas.
+        """
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>", "<ButtonPress-1>", "<B1-Motion>"):
+            self.canvas.unbind(sequence)
+        for item in self.overlay_items + [self.image_item, self.agent_item]:
+            self.canvas.delete(item)
+        self.overlay_items = []
+        self.image = None
+
+    def reset(self, labyrinth, q_values):
+        """
+        Shows a new labyrinth (or new Q values), with the whole map fitted in the viewport.
+        """
+        self.labyrinth = labyrinth
+        self.q = ModelIO.q_array(q_values, labyrinth, numpy.float32).reshape(labyrinth.height, labyrinth.width,
+                                                                             len(ACTIONS)).copy()
+        # size of a cell in pixels, and (row, column) of the cell at the top-left corner of the viewport
+        self.scale = self.snap(self.fitted_scale(), -1)
+        self.origin = [0.0, 0.0]
+        self.dirty = True
+
+    def update_q(self, q_updates):
+        """
+        :param q_updates: The changed Q values {(i, j, action): value}
+        """
+        for (i, j, action), value in q_updates.items():
+            self.q[i, j, ACTION_INDEX[action]] = value
+        if q_updates:
+            self.dirty = True
+
+    def move_agent(self, location):
+        self.agent_location = location
+        (x, y) = self.to_pixels(location[0] + 0.5, location[1] + 0.5)
+        radius = max(2.0, self.scale / 4)
+        self.canvas.coords(self.agent_item, x - radius, y - radius, x + radius, y + radius)
+        self.canvas.tag_raise(self.agent_item)
+
+    def to_pixels(self, row, column):
+        return (column - self.origin[1]) * self.scale, (row - self.origin[0]) * self.scale
+
+    def zoom(self, factor, x, y):
+        """
+        Zooms around the pixel (x, y) of the viewport.
+        """
+        (row, column) = (self.origin[0] + y / self.scale, self.origin[1] + x / self.scale)
+        scale = min(max(self.scale * factor, self.fitted_scale()), 4 * self.numbers_zoom)
+        self.scale = self.snap(scale, factor - 1)
+        self.origin = [row - y / self.scale, column - x / self.scale]
+        self.clamp()
+        self.dirty = True
+
+    def fitted_scale(self):
+        """
+        :return: The cell size at which the whole labyrinth fits in the viewport
+        """
+        return min(self.width / self.labyrinth.width, self.height / self.labyrinth.height)
+
+    @staticmethod
+    def snap(scale, direction):
+        """
+        Rounds a cell size so that the image is made of whole pixels: an integer number of pixels per cell,
+        or one pixel for an integer number of cells.
+        :param {float} scale: The cell size in pixels
+        :param {float} direction: > 0 when zooming in (rounds up), <= 0 otherwise (rounds down)
+        """
+        if scale >= 1:
+            return float(math.ceil(scale) if direction > 0 else math.floor(scale))
+        cells = 1 / scale
+        return 1.0 / (math.floor(cells) if direction > 0 else math.ceil(cells))
+
+    def start_drag(self, event):
+        self.drag_start = (event.x, event.y)
+
+    def drag(self, event):
+        if self.drag_start is None:
+            return
+        self.origin[0] -= (event.y - self.drag_start[1]) / self.scale
+        self.origin[1] -= (event.x - self.drag_start[0]) / self.scale
+        self.drag_start = (event.x, event.y)
+        self.clamp()
+        self.dirty = True
+
+    def clamp(self):
+        self.origin[0] = min(max(self.origin[0], 0.0), max(0.0, self.labyrinth.height - self.height / self.scale))
+        self.origin[1] = min(max(self.origin[1], 0.0), max(0.0, self.labyrinth.width - self.width / self.scale))
+
+    def render(self):
+        """
+        Redraws the visible region if the Q values or the viewport changed since the last call.
+        """
+        if not self.dirty:
+            return
+        self.dirty = False
+        row0, column0 = int(self.origin[0]), int(self.origin[1])
+        row1 = min(self.labyrinth.height, int(math.ceil(self.origin[0] + self.height / self.scale)))
+        column1 = min(self.labyrinth.width, int(math.ceil(self.origin[1] + self.width / self.scale)))
+        grid = self.labyrinth.grid[row0:row1, column0:column1]
+        q = self.q[row0:row1, column0:column1]
+
+        if self.scale >= 1:
+            (step, repeat) = (1, int(self.scale))
+        else:
+            (step, repeat) = (int(round(1 / self.scale)), 1)
+        self.image = tk.PhotoImage(master=self.canvas, data=ppm_data(heatmap_rgb(grid, q, step, repeat)),
+                                   format="PPM")
+        (x, y) = self.to_pixels(row0, column0)
+        self.canvas.coords(self.image_item, x, y)
+        self.canvas.itemconfig(self.image_item, image=self.image)
+
+        for item in self.overlay_items:
+            self.canvas.delete(item)
+        self.overlay_items = []
+        if self.scale >= self.arrows_zoom:
+            self.draw_arrows(grid, q, row0, column0)
+        if self.scale >= self.numbers_zoom:
+            self.draw_numbers(q, row0, column0)
+        self.move_agent(self.agent_location)
+
+    def draw_arrows(self, grid, q, row0, column0):
+        """
+        Draws the greedy action of the visible free cells.
+        """
+        greedy = q.argmax(axis=2)
+        decision = numpy.isfinite(q.max(axis=2)) & (grid != 0) & (grid != -1)
+        length = 0.35 * self.scale
+        for (i, j) in numpy.argwhere(decision).tolist():
+            (x, y) = self.to_pixels(row0 + i + 0.5, column0 + j + 0.5)
+            (di, dj) = MOVES[greedy[i, j]]
+            self.overlay_items.append(self.canvas.create_line(x, y, x + dj * length, y + di * length,
+                                                              arrow=tk.LAST, fill="white"))
+
+    def draw_numbers(self, q, row0, column0):
+        """
+        Draws the Q values of the possible actions of the visible cells.
+        """
+        offset = 0.3 * self.scale
+        for (i, j, a) in numpy.argwhere(numpy.isfinite(q)).tolist():
+            (x, y) = self.to_pixels(row0 + i + 0.5, column0 + j + 0.5)
+            (di, dj) = MOVES[a]
+            self.overlay_items.append(self.canvas.create_text(x + dj * offset, y + di * offset, fill="red",
+                                                              text="%.1f" % q[i, j, a]))
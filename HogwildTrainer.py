@@ -0,0 +1,254 @@
+"""
+Parallel training of one labyrinth, Hogwild-style: N worker processes run episodes against the same labyrinth and
+update a single Q-table in shared memory (multiprocessing.shared_memory) without any lock. Each worker is an Agent
+with the numpy backend whose Q values are a view of the shared (height, width, 4) array, with its own random
+stream (spawned from the seed of the trainer) and its own start cells. Two workers rarely update the same Q value
+at the same time on a large map, and a lost update only slows the convergence down a little.
+
+The calling process is the coordinator: the workers publish their episode and step counts in a second shared
+array, and the coordinator stops all of them when the episode budget (shared by the workers), the time budget
+or the convergence criterion is reached:
+    - q-delta: the largest Q change was below the threshold during the last patience episodes of every worker
+    - greedy-path: the greedy path from the start cell did not change during patience checks of the coordinator
+
+Example:
+    python HogwildTrainer.py maze1000.npy --workers 32 --nb-episodes 100000 --exploration-rate 0.3 \
+        --time-budget 3600 --output maze1000.qmodel
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+from multiprocessing import connection, shared_memory
+
+import numpy
+
+import ModelIO
+from Agent import Agent
+from Labyrinth import ACTIONS, Labyrinth
+from QTable import ArrayQTable
+from RandomStream import RandomStream
+
+# Columns of the shared array of the counts published by the workers (one row per worker)
+EPISODES = 0
+STEPS = 1
+STABLE_EPISODES = 2
+STATS = ("episodes", "steps", "stable_episodes")
+# Time (in seconds) between two checks of the stop event by a worker
+STOP_POLL_INTERVAL = 0.05
+
+
+def _stop_when_set(event, agent):
+    # polled rather than waited: a process that exits while waiting on a multiprocessing.Event blocks its set()
+    while not event.is_set():
+        time.sleep(STOP_POLL_INTERVAL)
+    agent.stop = True
+
+
+def _run_worker(index, environment, q_memory, stats_memory, workers, stop, nb_episodes, rng, parameters):
+    q = numpy.ndarray((environment.height, environment.width, len(ACTIONS)), numpy.float64, buffer=q_memory.buf)
+    stats = numpy.ndarray((workers, len(STATS)), numpy.float64, buffer=stats_memory.buf)
+    agent = Agent(environment=environment, nb_episodes=nb_episodes, headless=True, q_backend="numpy", rng=rng,
+                  **parameters)
+    agent.Q = ArrayQTable.from_array(q, environment, copy=False)
+    # the current episode is cut as soon as the coordinator stops the training
+    threading.Thread(target=_stop_when_set, args=(stop, agent), daemon=True).start()
+    stable_episodes = 0
+    while not agent.stop:
+        totals = stats.sum(axis=0)
+        if totals[EPISODES] >= nb_episodes:
+            break
+        # the schedules follow the steps and episodes of the whole training, not those of this worker
+        agent.total_steps = int(totals[STEPS])
+        (steps, _) = agent.run_episode(int(totals[EPISODES]) + 1)
+        stable_episodes = stable_episodes + 1 if agent.episode_max_delta < agent.convergence_threshold else 0
+        stats[index] = (stats[index, EPISODES] + 1, stats[index, STEPS] + steps, stable_episodes)
+
+
+def _work(index, environment, q_name, stats_name, workers, stop, nb_episodes, rng, parameters):
+    """
+    Entry point of a worker process.
+    """
+    q_memory = shared_memory.SharedMemory(name=q_name)
+    stats_memory = shared_memory.SharedMemory(name=stats_name)
+    _run_worker(index, environment, q_memory, stats_memory, workers, stop, nb_episodes, rng, parameters)
+    # the views of the shared arrays are released with the frame of _run_worker
+    q_memory.close()
+    stats_memory.close()
+
+
+class HogwildTrainer:
+    """
+    Trains one Q-table with several processes sharing it (see the module documentation).
+    """
+
+    def __init__(self, policy, environment, nb_episodes, workers=None, seed=None, start="fixed", start_cells=None,
+                 convergence=None, convergence_threshold=1e-3, convergence_patience=5, time_budget=None,
+                 check_interval=0.5, **agent_parameters):
+        """
+        :param {str} policy: AI of the workers. Possible values: random|e-greedy|softmax
+        :param {Labyrinth.Labyrinth} environment: The labyrinth
+        :param {int} nb_episodes: Number of episodes of the whole training, shared by the workers (the episodes
+                                 already started when it is reached are finished)
+        :param {int} workers: Number of worker processes (default: number of cores)
+        :param {int} seed: Seed of the random stream the streams of the workers are spawned from
+        :param {str} start: distribution of the first cell of the episodes of each worker (see Agent):
+                            fixed|uniform|inverse-visits (the visits being those of the worker). fixed by default,
+                            as for Agent; uniform spreads the workers over the map and only draws cells that
+                            lead to the goal (Labyrinth.start_candidates)
+        :param {list} start_cells: if given, worker k always starts its episodes in start_cells[k % len(start_cells)]
+        :param {str} convergence: early stopping criterion. Possible values: None|q-delta|greedy-path
+        :param {float} convergence_threshold: threshold of the q-delta criterion
+        :param {int} convergence_patience: number of consecutive episodes of every worker (q-delta) or of checks of
+                                           the coordinator (greedy-path) the criterion must hold to stop
+        :param {float} time_budget: if given, the training stops after this number of seconds
+        :param {float} check_interval: time (in seconds) between two checks of the coordinator
+        :param agent_parameters: the other parameters of the agents of the workers (hyperparameters, schedules,
+                                 planning, max_steps_per_episode, start_cell, ...). The Q-table backend is numpy.
+        """
+        for name in ('q_backend', 'headless', 'metrics', 'checkpointer', 'rng', 'time_budget'):
+            if name in agent_parameters:
+                raise ValueError("The parameter " + name + " of the agents cannot be set for a parallel training !")
+        if workers is not None and workers < 1:
+            raise ValueError("A parallel training needs at least one worker !")
+        if check_interval <= 0:
+            raise ValueError("Check interval must be positive !")
+        self.environment = environment
+        self.nb_episodes = nb_episodes
+        self.workers = workers or multiprocessing.cpu_count()
+        self.time_budget = time_budget
+        self.check_interval = check_interval
+        self.rng = RandomStream(seed)
+
+        parameters = dict(agent_parameters, policy=policy, start=start, convergence=convergence,
+                          convergence_threshold=convergence_threshold, convergence_patience=convergence_patience)
+        # the agent of the coordinator validates the parameters, follows the greedy path of the shared Q values
+        # and holds the trained Q values in the end
+        self.agent = Agent(environment=environment, nb_episodes=nb_episodes, headless=True, q_backend="numpy",
+                           rng=self.rng, **parameters)
+        self.worker_parameters = []
+        for k in range(self.workers):
+            worker = dict(parameters)
+            if start_cells:
+                worker.update(start="fixed", start_cell=tuple(start_cells[k % len(start_cells)]))
+                Agent(environment=environment, nb_episodes=nb_episodes, headless=True, q_backend="numpy", **worker)
+            self.worker_parameters.append(worker)
+        self.training_summary = None
+
+    def train(self):
+        """
+        Runs the workers until the end of the training.
+        :return: A training summary (number of episodes and steps, overall and per worker, reason of the end of
+                 the training, wall time in seconds, throughput)
+        """
+        start_time = time.perf_counter()
+        deadline = start_time + self.time_budget if self.time_budget is not None else None
+        q_memory = shared_memory.SharedMemory(create=True, size=self.agent.Q.values.nbytes)
+        stats_memory = shared_memory.SharedMemory(create=True, size=self.workers * len(STATS) * 8)
+        stop = multiprocessing.Event()
+        processes = []
+        try:
+            q = numpy.ndarray(self.agent.Q.values.shape, numpy.float64, buffer=q_memory.buf)
+            q[...] = self.agent.Q.values
+            stats = numpy.ndarray((self.workers, len(STATS)), numpy.float64, buffer=stats_memory.buf)
+            stats[...] = 0
+            self.agent.Q = ArrayQTable.from_array(q, self.environment, copy=False)
+            for k, (rng, parameters) in enumerate(zip(self.rng.spawn(self.workers), self.worker_parameters)):
+                process = multiprocessing.Process(target=_work, name="hogwild-%d" % k, daemon=True,
+                                                  args=(k, self.environment, q_memory.name, stats_memory.name,
+                                                        self.workers, stop, self.nb_episodes, rng, parameters))
+                process.start()
+                processes.append(process)
+
+            stop_reason = "episodes"
+            stable_checks = 0
+            previous_path = None
+            while True:
+                running = [process.sentinel for process in processes if process.exitcode is None]
+                if not running or any(process.exitcode for process in processes):
+                    break
+                connection.wait(running, self.check_interval)
+                if stop.is_set():
+                    continue
+                if deadline is not None and time.perf_counter() >= deadline:
+                    stop_reason = "time_budget"
+                    stop.set()
+                elif self.agent.convergence == 'q-delta':
+                    if stats[:, STABLE_EPISODES].min() >= self.agent.convergence_patience:
+                        stop_reason = "converged"
+                        stop.set()
+                elif self.agent.convergence == 'greedy-path':
+                    path = self.agent.greedy_path()
+                    stable_checks = stable_checks + 1 if path is not None and path == previous_path else 0
+                    previous_path = path
+                    if stable_checks >= self.agent.convergence_patience:
+                        stop_reason = "converged"
+                        stop.set()
+            stop.set()
+            for process in processes:
+                process.join()
+            failed = [process for process in processes if process.exitcode]
+            if failed:
+                raise RuntimeError("The worker %s of the parallel training failed with exit code %d !"
+                                   % (failed[0].name, failed[0].exitcode))
+            totals = stats.copy()
+        finally:
+            stop.set()
+            for process in processes:
+                process.join()
+            # the Q values are copied out of the shared memory, whose views must be released before it is closed
+            self.agent.Q = ArrayQTable.from_array(self.agent.Q.values, self.environment)
+            q = stats = None
+            q_memory.close()
+            q_memory.unlink()
+            stats_memory.close()
+            stats_memory.unlink()
+
+        wall_time = time.perf_counter() - start_time
+        self.training_summary = {
+            "workers": self.workers,
+            "episodes": int(totals[:, EPISODES].sum()),
+            "total_steps": int(totals[:, STEPS].sum()),
+            "worker_episodes": totals[:, EPISODES].astype(int).tolist(),
+            "worker_steps": totals[:, STEPS].astype(int).tolist(),
+            "stop_reason": stop_reason,
+            "wall_time": wall_time,
+            "episodes_per_second": float(totals[:, EPISODES].sum()) / wall_time,
+            "steps_per_second": float(totals[:, STEPS].sum()) / wall_time
+        }
+        self.agent.training_summary = self.training_summary
+        return self.training_summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trains one labyrinth with several processes sharing a Q-table.")
+    parser.add_argument("map", help=".map or .npy file")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument("--policy", default="e-greedy", choices=["random", "e-greedy", "softmax"])
+    parser.add_argument("--nb-episodes", type=int, default=1000)
+    parser.add_argument("--exploration-rate", type=float, default=-1)
+    parser.add_argument("--temperature", type=float, default=-1)
+    parser.add_argument("--discount-rate", type=float, default=0.5)
+    parser.add_argument("--learning-rate", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--start", default="fixed", choices=["fixed", "uniform", "inverse-visits"])
+    parser.add_argument("--convergence", default=None, choices=["q-delta", "greedy-path"])
+    parser.add_argument("--convergence-threshold", type=float, default=1e-3)
+    parser.add_argument("--convergence-patience", type=int, default=5)
+    parser.add_argument("--max-steps-per-episode", type=int, default=None)
+    parser.add_argument("--time-budget", type=float, default=None, help="in seconds")
+    parser.add_argument("--output", required=True, help=".json or .qmodel file")
+    args = parser.parse_args()
+
+    labyrinth = Labyrinth.from_file(args.map)
+    trainer = HogwildTrainer(args.policy, labyrinth, args.nb_episodes, args.workers, args.seed, start=args.start,
+                             convergence=args.convergence, convergence_threshold=args.convergence_threshold,
+                             convergence_patience=args.convergence_patience, time_budget=args.time_budget,
+                             exploration_rate=args.exploration_rate, temperature=args.temperature,
+                             discount_rate=args.discount_rate, learning_rate=args.learning_rate,
+                             max_steps_per_episode=args.max_steps_per_episode)
+    summary = trainer.train()
+    ModelIO.save_model(args.output, trainer.agent.Q, labyrinth, ModelIO.agent_metadata(trainer.agent))
+    print("%d episodes (%s) by %d workers, %d steps in %.2fs (%.0f steps/s), model written to %s"
+          % (summary["episodes"], summary["stop_reason"], summary["workers"], summary["total_steps"],
+             summary["wall_time"], summary["steps_per_second"], args.output))
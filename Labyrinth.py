@@ -1,39 +1,200 @@
+import numpy
+
+import MapLoader
+
+# Actions of the agent, in the order used by the lookup tables (and the Q arrays).
+ACTIONS = ("up", "down", "left", "right")
+ACTION_INDEX = {action: index for index, action in enumerate(ACTIONS)}
+# (di, dj) displacement of each action
+MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1))
+# Reward for entering a cell, given its code
+REWARDS = {1: -1, 2: -75, -1: 100}
+# Possible actions and their moves for each of the 16 subsets of ACTIONS (bit a set if ACTIONS[a] is possible)
+ACTION_SETS = tuple([action for a, action in enumerate(ACTIONS) if code >> a & 1] for code in range(16))
+ACTION_MOVES = tuple({action: MOVES[a] for a, action in enumerate(ACTIONS) if code >> a & 1} for code in range(16))
+# Reward for entering a cell, given the unsigned byte of its int8 code
+CELL_REWARDS = tuple(REWARDS.get(code if code < 128 else code - 256) for code in range(256))
+GOAL = -1 & 0xFF
+# The same rewards as a float32 array (0 for the rocks)
+CELL_REWARD_TABLE = numpy.array([reward or 0 for reward in CELL_REWARDS], dtype=numpy.float32)
+
+
 class Labyrinth:
     def __init__(self, adjacency_matrix):
-        self.adjacency_matrix = adjacency_matrix
+        """
+        :param adjacency_matrix: The map, as a list of lists, an int8 array or a memory-mapped binary map
+                                 (see MapLoader)
+        """
         self.actions = {"up", "down", "left", "right"}
+        self.adjacency_matrix = adjacency_matrix
 
-    def get_possible_actions(self, i, j):
+    @classmethod
+    def from_file(cls, path):
         """
-        Returns the possible directions one can take given a (i,j) position in
-        the labyrinth
-        :param i: the y coordinate
-        :param j: the x coordinate
-        :return: array of possible actions
+        Loads a labyrinth from a .map (CSV) or .npy (binary, memory-mapped) file.
+        """
+        return cls(MapLoader.load_map(path))
+
+    @property
+    def adjacency_matrix(self):
+        return self._adjacency_matrix
+
+    @adjacency_matrix.setter
+    def adjacency_matrix(self, adjacency_matrix):
+        """
+        Replacing the adjacency matrix rebuilds the lookup tables.
+        """
+        self._adjacency_matrix = adjacency_matrix
+        self.compile()
+
+    def compile(self):
+        """
+        Compiles the adjacency matrix into compact tables of one byte per cell, indexed by the state
+        s = i * width + j:
+            - terminal[s]: True if an episode ends in s
+            - start_candidates: the sorted states an episode can start from: neither rock nor goal, with a possible
+              action and from which a goal can be reached
+            - the possible actions of each cell (a bit per action, see ACTIONS) and its code, for the step-by-step
+              queries of the agent
+        The flat lookup tables of the whole map, indexed by s and the action index a, are built on first use
+        (see transitions for the tables of some states only):
+            - next_state[s, a]: the state reached by taking a in s (-1 if a is not possible in s)
+            - rewards[s, a]: the reward for taking a in s (0 if a is not possible in s)
+            - valid[s, a]: True if a is possible in s
+        Must be called again if the adjacency matrix is modified in place.
+        """
+        grid = numpy.asarray(self._adjacency_matrix, dtype=numpy.int8)
+        if grid.ndim != 2 or grid.size == 0:
+            raise ValueError("The adjacency matrix must be a non-empty rectangular matrix !")
+        unknown = ~numpy.isin(grid, [0] + list(REWARDS))
+        if unknown.any():
+            (i, j) = numpy.argwhere(unknown)[0]
+            raise ValueError("location undefined: cell (" + str(i) + ", " + str(j) + ") = " + str(grid[i, j]))
+
+        self.height, self.width = grid.shape
+        self.grid = grid
+        self._valid = self._next_state = self._rewards = None
+        # bit a of codes[i, j] is set if ACTIONS[a] is possible in (i, j): both cells are free
+        free = grid != 0
+        codes = numpy.zeros(grid.shape, dtype=numpy.uint8)
+        codes[1:] |= (free[1:] & free[:-1]) * numpy.uint8(1)
+        codes[:-1] |= (free[:-1] & free[1:]) * numpy.uint8(2)
+        codes[:, 1:] |= (free[:, 1:] & free[:, :-1]) * numpy.uint8(4)
+        codes[:, :-1] |= (free[:, :-1] & free[:, 1:]) * numpy.uint8(8)
+        self._action_codes = codes.tobytes()
+        self._cells = grid.tobytes()
+        self.terminal = grid.ravel() == -1
+        # states an episode can start from: a cell walled in or cut off from the goals would never end an episode.
+        # The moves are symmetric between free cells, so the reverse flood fill from the goals follows the moves.
+        leads_to_goal = self._flood(numpy.flatnonzero(self.terminal), through_terminal=True) >= 0
+        self.start_candidates = numpy.flatnonzero(leads_to_goal & ~self.terminal
+                                                  & (codes.ravel() != 0)).astype(numpy.int32)
+
+    @property
+    def valid(self):
+        if self._valid is None:
+            self._compile_tables()
+        return self._valid
+
+    @property
+    def next_state(self):
+        if self._next_state is None:
+            self._compile_tables()
+        return self._next_state
+
+    @property
+    def rewards(self):
+        if self._rewards is None:
+            self._compile_tables()
+        return self._rewards
+
+    def _compile_tables(self):
+        (self._next_state, self._rewards, self._valid) = self.transitions(numpy.arange(self.height * self.width))
+
+    def transitions(self, states):
         """
-        assert 0 <= i < len(self.adjacency_matrix)
-        assert 0 <= j < len(self.adjacency_matrix[i])
+        Lookup tables of some states only (e.g. the reachable ones, see QTable.SparseQTable).
+        :param states: The flat indices of the states
+        :return: (next_state, rewards, valid) (len(states), 4) arrays, as the tables of the whole map
+        """
+        states = numpy.asarray(states, dtype=numpy.int64)
+        codes = numpy.frombuffer(self._action_codes, dtype=numpy.uint8)[states]
+        valid = (codes[:, None] >> numpy.arange(len(ACTIONS), dtype=numpy.uint8) & 1).astype(bool)
+        offsets = numpy.array([di * self.width + dj for di, dj in MOVES], dtype=numpy.int64)
+        next_state = numpy.where(valid, states[:, None] + offsets, -1).astype(numpy.int32)
+        cells = numpy.frombuffer(self._cells, dtype=numpy.uint8)[numpy.maximum(next_state, 0)]
+        rewards = numpy.where(valid, CELL_REWARD_TABLE[cells], numpy.float32(0))
+        return next_state, rewards, valid
 
-        if self.adjacency_matrix[i][j] == 0:
-            return []
+    def reachable_states(self, starts=(0,)):
+        """
+        Flood fill of the possible moves: the states an agent can reach from start states
+        (an episode ends in the goal, so the fill does not go through it).
+        :param starts: The start states (flat indices, see state_index)
+        :return: The sorted int32 array of the reachable states
+        """
+        return numpy.flatnonzero(self._flood(starts) >= 0).astype(numpy.int32)
 
-        height = len(self.adjacency_matrix)
-        width = len(self.adjacency_matrix[i])
-        possible_actions = []
+    def distances(self, starts=(0,)):
+        """
+        Breadth-first search of the possible moves, going on through the goals (see MapGenerator.distances).
+        :param starts: The start states (flat indices, see state_index)
+        :return: The (height, width) int32 array of the number of moves from the nearest start state
+                 (-1 for the states that cannot be reached)
+        """
+        return self._flood(starts, through_terminal=True).reshape(self.height, self.width)
 
-        # up - down
-        if i - 1 >= 0 and self.adjacency_matrix[i - 1][j] != 0:
-            possible_actions.append("up")
-        if i + 1 < height and self.adjacency_matrix[i + 1][j] != 0:
-            possible_actions.append("down")
+    def _flood(self, seeds, through_terminal=False):
+        """
+        Breadth-first flood fill of the possible moves, one array operation per level.
+        :param seeds: The first states (flat indices), the rocks among them are ignored
+        :param {bool} through_terminal: If False, the fill does not go on from the terminal states
+        :return: The (height * width,) int32 array of the level at which each state is filled
+                 (its number of moves from the nearest seed, -1 for the states not filled)
+        """
+        codes = numpy.frombuffer(self._action_codes, dtype=numpy.uint8)
+        bits = numpy.arange(len(ACTIONS), dtype=numpy.uint8)
+        offsets = numpy.array([di * self.width + dj for di, dj in MOVES], dtype=numpy.int64)
+        level = numpy.full(self.height * self.width, -1, dtype=numpy.int32)
+        frontier = numpy.unique(numpy.asarray(seeds, dtype=numpy.int64))
+        frontier = frontier[self.grid.ravel()[frontier] != 0]
+        level[frontier] = 0
+        depth = 0
+        while frontier.size:
+            if not through_terminal:
+                frontier = frontier[~self.terminal[frontier]]
+            moves = (codes[frontier, None] >> bits & 1).astype(bool)
+            neighbours = numpy.unique((frontier[:, None] + offsets)[moves])
+            frontier = neighbours[level[neighbours] < 0]
+            depth += 1
+            level[frontier] = depth
+        return level
 
-        # left - right
-        if j - 1 >= 0 and self.adjacency_matrix[i][j - 1] != 0:
-            possible_actions.append("left")
-        if j + 1 < width and self.adjacency_matrix[i][j + 1] != 0:
-            possible_actions.append("right")
+    def is_start_candidate(self, i, j):
+        """
+        :return: True if an episode can start in (i, j) (see start_candidates)
+        """
+        if not (0 <= i < self.height and 0 <= j < self.width):
+            return False
+        s = i * self.width + j
+        k = numpy.searchsorted(self.start_candidates, s)
+        return bool(k < len(self.start_candidates) and self.start_candidates[k] == s)
 
-        return possible_actions
+    def state_index(self, i, j):
+        """
+        :return: The flat index of the state (i, j) in the lookup tables
+        """
+        return i * self.width + j
+
+    def get_possible_actions(self, i, j):
+        """
+        Returns the possible directions one can take given a (i,j) position in
+        the labyrinth. The returned list is shared and must not be modified.
+        :param i: the y coordinate
+        :param j: the x coordinate
+        :return: array of possible actions
+        """
+        return ACTION_SETS[self._action_codes[i * self.width + j]]
 
     def get_reward(self, state, action):
         """
@@ -42,18 +203,22 @@ class Labyrinth:
         :param action: where we want to go
         :return: a reward according to the new location
         """
-        (i, j) = self.get_location(*state, action)
-        if self.adjacency_matrix[i][j] == 1:
-            return -1
-        elif self.adjacency_matrix[i][j] == 2:
-            return -75
-        elif self.adjacency_matrix[i][j] == -1:
-            return 100
-        else:
+        (i, j) = self.move(state[0], state[1], action)
+        return CELL_REWARDS[self._cells[i * self.width + j]]
+
+    def move(self, i, j, action):
+        """
+        Same as get_location, but looked up in the precomputed tables. Only defined for possible actions.
+        :return: The location reached by taking the action in (i, j)
+        """
+        try:
+            (di, dj) = ACTION_MOVES[self._action_codes[i * self.width + j]][action]
+        except KeyError:
             raise ValueError("location undefined")
+        return i + di, j + dj
 
     def is_out(self, i, j):
-        return self.adjacency_matrix[i][j] == -1  # states for which an episode ends
+        return self._cells[i * self.width + j] == GOAL  # states for which an episode ends
 
     @staticmethod
     def get_location(i, j, action):
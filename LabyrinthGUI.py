@@ -1,21 +1,36 @@
-import json
-import random
+import threading
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, messagebox
 from tkinter.font import Font
 
+import MapLoader
+import ModelIO
+from QTable import ArrayQTable
+from HeatmapView import HeatmapView
+from RandomStream import RandomStream
+from TrainingChannel import TrainingChannel
+
+
+# position of the action values in a tile
+ACTION_VALUE_OFFSETS = {"up": (30, 20), "down": (30, 40), "left": (10, 30), "right": (50, 30)}
+
 
 class LabyrinthGUI(tk.Frame):
     """
     This class defines the main window look and feel.
     """
 
-    def __init__(self, root, labyrinth, agent):
+    def __init__(self, root, labyrinth, agent, seed=None, frame_rate=30, lod_threshold=10, viewport=640):
         """
         Creates a window that will show a visualisation of the agent exploring the labyrinth.
         :param root: a tkinter root window
         :param labyrinth: an instance of the labyrinth
         :param agent: an instance of the agent
+        :param seed: seed of the random stream choosing the tile variants
+        :param frame_rate: number of times per second the view is refreshed
+        :param lod_threshold: labyrinths with more rows or columns than this are drawn with a zoomable heatmap
+                              (see HeatmapView) instead of tiles (the tiles are centred for at most 10 rows)
+        :param viewport: size in pixels of the heatmap view
         """
         tk.Frame.__init__(self, root)
         self.root = root
@@ -23,21 +38,36 @@ class LabyrinthGUI(tk.Frame):
         self.root.title("Labyrinthe magique")  # the title
         self.square_width = 64  # dimension of a tile
         self.square_height = 64  # dimension of a tile
-        self.width = self.square_width * len(labyrinth.adjacency_matrix[0])  # the dimension
-        self.height = self.square_height * len(labyrinth.adjacency_matrix)  # the dimension
-        self.root.config(width=self.width, height=self.height)  # we set the dimension of the window
+        self.lod_threshold = lod_threshold
+        self.viewport = viewport
+        # the heatmap view, used instead of the tiles for large labyrinths
+        self.view = None
 
         # we store the instance of the labyrinth and the agent
         self.labyrinth = labyrinth
         self.agent = agent
+        self.update_canvas_size()
+        self.root.config(width=self.width, height=self.height)  # we set the dimension of the window
+        # random stream used to alternate the tile images
+        self.rng = RandomStream(seed)
         # labyrinth grid center parameter
         self.c = (10 - len(self.labyrinth.adjacency_matrix)) / 2 if len(self.labyrinth.adjacency_matrix) <= 10 else 0
         # we are an observer of the agent, we then add ourself to its list of observers
         self.agent.add_observer(self)
+        # and we want to know which Q values it changes
+        self.agent.track_changes = True
         # this tuple will contain the position of the agent
         self.position_agent_gui = None
         # this list will contain the numbers you visualise in red in the GUI
         self.action_values = []
+        # canvas items of the tiles (tile, overlay, image variant) and text displayed by each action value
+        self.tiles = None
+        self.displayed_values = {}
+        # the agent is trained on a worker thread, which publishes its state in a channel
+        # that we poll at a fixed frame rate
+        self.frame_rate = frame_rate
+        self.channel = TrainingChannel()
+        self.worker = None
 
         # image resources used in the GUI
         self.res = {
@@ -259,8 +289,8 @@ class LabyrinthGUI(tk.Frame):
 
         # after every widgets are placed on the view,
         # we draw the view of the labyrinth
-        self.draw_grid()
-        self.draw_agent()
+        self.draw_labyrinth()
+        self.poll()
 
     def set_learning_rate(self, value):
         self.agent.learning_rate = float(value)
@@ -283,56 +313,95 @@ class LabyrinthGUI(tk.Frame):
     def set_exp_rate(self, value):
         self.agent.exploration_rate = float(value)
 
+    def is_large(self):
+        """
+        :return: True if the labyrinth is drawn with the heatmap view
+        """
+        return max(self.labyrinth.height, self.labyrinth.width) > self.lod_threshold
+
+    def draw_labyrinth(self):
+        """
+        Draws the labyrinth and the agent, with tiles or with the heatmap view if the labyrinth is large.
+        """
+        if self.is_large():
+            if self.view is None:
+                self.canvas.delete("all")
+                self.tiles = None
+                self.position_agent_gui = None
+                self.view = HeatmapView(self.canvas, self.labyrinth, self.agent.Q, self.viewport, self.viewport)
+            else:
+                self.view.reset(self.labyrinth, self.agent.Q)
+            self.view.move_agent(self.agent.start_cell)
+            self.view.render()
+        else:
+            if self.view is not None:
+                self.view.destroy()
+                self.view = None
+            self.draw_grid()
+            self.draw_agent()
+
     def draw_grid(self):
         """
-        Draw a view of the labyrinth
+        Draw a view of the labyrinth. The canvas items of a previous labyrinth of the same shape are reused:
+        only their images and texts are updated.
         """
+        height = len(self.labyrinth.adjacency_matrix)
+        width = len(self.labyrinth.adjacency_matrix[0])
+        if self.tiles is None or len(self.tiles) != height or len(self.tiles[0]) != width:
+            self.create_grid_items(height, width)
+        for i in range(height):
+            for j in range(width):
+                (_, overlay, alternate) = self.tiles[i][j]
+                cell = int(self.labyrinth.adjacency_matrix[i][j])
+                if cell != 1:
+                    self.canvas.itemconfig(overlay, image=self.res[str(cell) + alternate], state=tk.NORMAL)
+                else:
+                    self.canvas.itemconfig(overlay, state=tk.HIDDEN)
+
+                # drawing action values
+                possible_actions = self.labyrinth.get_possible_actions(i, j)
+                for action, item in self.action_values[i][j].items():
+                    if action in possible_actions:
+                        self.set_action_value(item, self.agent.Q[i][j][action])
+                        self.canvas.itemconfig(item, state=tk.NORMAL)
+                    else:
+                        self.canvas.itemconfig(item, state=tk.HIDDEN)
+
+    def create_grid_items(self, height, width):
+        """
+        Creates the canvas items of every cell: a tile, an overlay (rock, trap or goal) and the four action values.
+        """
+        self.canvas.delete("all")
+        self.position_agent_gui = None
+        self.displayed_values = {}
         # labyrinth grid center parameter
-        self.c = (10 - len(self.labyrinth.adjacency_matrix)) / 2 if len(self.labyrinth.adjacency_matrix) <= 10 else 0
-        for i in range(len(self.labyrinth.adjacency_matrix)):
+        self.c = (10 - height) / 2 if height <= 10 else 0
+        self.tiles = []
+        self.action_values = []
+        for i in range(height):
+            self.tiles.append([])
             self.action_values.append([])
-            for j in range(len(self.labyrinth.adjacency_matrix[i])):
-                self.action_values[i].append([])
+            for j in range(width):
+                (x, y) = (j * self.square_width, (i + self.c) * self.square_height)
                 # drawing grid
-                alternate = "b" if random.random() <= .5 else ""
-                self.canvas.create_image(j * self.square_width,
-                                         (i + self.c) * self.square_height,
-                                         image=self.res["1" + alternate],
-                                         anchor='nw')
-                if self.labyrinth.adjacency_matrix[i][j] != 1:
-                    self.canvas.create_image(j * self.square_width,
-                                             (i + self.c) * self.square_height,
-                                             image=self.res[str(self.labyrinth.adjacency_matrix[i][j]) + alternate],
-                                             anchor='nw')
-                self.canvas.grid()
+                alternate = "b" if self.rng.random() <= .5 else ""
+                tile = self.canvas.create_image(x, y, image=self.res["1" + alternate], anchor='nw')
+                overlay = self.canvas.create_image(x, y, image=self.res["1" + alternate], anchor='nw', state=tk.HIDDEN)
+                self.tiles[i].append((tile, overlay, alternate))
+                self.action_values[i].append({
+                    action: self.canvas.create_text(x + dx, y + dy, fill="red", text="", state=tk.HIDDEN)
+                    for action, (dx, dy) in ACTION_VALUE_OFFSETS.items()
+                })
+        self.canvas.grid()
 
-                # drawing action values
-                possible_actions = self.labyrinth.get_possible_actions(i, j)
-                self.action_values[i][j] = {}
-                if "up" in possible_actions:
-                    self.action_values[i][j]["up"] = self.canvas.create_text(j * self.square_width + 30,
-                                                                             (i + self.c) * self.square_height + 20,
-                                                                             fill="red",
-                                                                             text=str(
-                                                                                 "%.1f" % self.agent.Q[i][j]["up"]))
-                if "down" in possible_actions:
-                    self.action_values[i][j]["down"] = self.canvas.create_text(j * self.square_width + 30,
-                                                                               (i + self.c) * self.square_height + 40,
-                                                                               fill="red",
-                                                                               text=str(
-                                                                                   "%.1f" % self.agent.Q[i][j]["down"]))
-                if "left" in possible_actions:
-                    self.action_values[i][j]["left"] = self.canvas.create_text(j * self.square_width + 10,
-                                                                               (i + self.c) * self.square_height + 30,
-                                                                               fill="red",
-                                                                               text=str(
-                                                                                   "%.1f" % self.agent.Q[i][j]["left"]))
-                if "right" in possible_actions:
-                    self.action_values[i][j]["right"] = self.canvas.create_text(j * self.square_width + 50,
-                                                                                (i + self.c) * self.square_height + 30,
-                                                                                fill="red",
-                                                                                text=str("%.1f" % self.agent.Q[i][j][
-                                                                                    "right"]))
+    def set_action_value(self, item, value):
+        """
+        Updates the text of an action value, only if its displayed value changes.
+        """
+        text = "%.1f" % value
+        if self.displayed_values.get(item) != text:
+            self.displayed_values[item] = text
+            self.canvas.itemconfig(item, text=text)
 
     def enable_learning(self):
         self.agent.learning_done = False
@@ -341,96 +410,153 @@ class LabyrinthGUI(tk.Frame):
         self.agent.learning_done = True
 
     def start(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
         self.agent.stop = False
         self.radio_learning_disabled["state"] = tk.DISABLED
         self.radio_learning_enabled["state"] = tk.DISABLED
-        self.agent.play()
+        # the agent plays on a worker thread so that the window stays responsive
+        self.worker = threading.Thread(target=self.agent.play, daemon=True)
+        self.worker.start()
 
     def stop(self):
         self.radio_learning_disabled["state"] = tk.ACTIVE
         self.radio_learning_enabled["state"] = tk.ACTIVE
         self.agent.stop = True
 
-    def update_position_agent(self):
-        (i, j) = self.agent.current_location
-        if self.position_agent_gui is not None:
-            self.canvas.delete(self.position_agent_gui)
-
-        self.position_agent_gui = self.canvas.create_image(j * self.square_width + 20,
-                                                           (i + self.c) * self.square_height + 20,
-                                                           image=self.res["pikachu"],
-                                                           anchor='nw')
+    def stop_worker(self):
+        """
+        Stops the agent and waits for the worker thread, before the labyrinth or the Q values are replaced.
+        """
+        self.stop()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.channel.clear()
 
-        value = "%.1f" % self.agent.Q[i][j][self.agent.action_taken]
-        self.canvas.itemconfig(self.action_values[i][j][self.agent.action_taken], text=value)
-        self.canvas.grid()
-        self.canvas.update()
+    def poll(self):
+        """
+        Draws the latest state published by the agent, then schedules the next frame.
+        """
+        snapshot, q_updates = self.channel.collect()
+        if self.view is not None:
+            self.view.update_q(q_updates)
+        else:
+            for (i, j, action), value in q_updates.items():
+                self.set_action_value(self.action_values[i][j][action], value)
+        if snapshot is not None:
+            (location, action, episode) = snapshot
+            self.infos['text'] = "Episode: " + str(episode + 1)
+            if self.view is not None:
+                self.view.move_agent(location)
+            else:
+                self.update_position_agent(location)
+        if self.view is not None:
+            # redraws only if the Q values, the zoom or the position of the view changed
+            self.view.render()
+        self.after(max(1, 1000 // self.frame_rate), self.poll)
+
+    def update_position_agent(self, location):
+        (i, j) = location
+        # the agent image is moved, not recreated
+        self.canvas.coords(self.position_agent_gui,
+                           j * self.square_width + 20,
+                           (i + self.c) * self.square_height + 20)
 
     def update_observation(self):
-        self.infos['text'] = "Episode: " + str(self.agent.current_episode+1)
-        self.update_position_agent()
+        """
+        Called by the agent, on the training thread: the state is only published, the drawing is done by poll.
+        """
+        (i, j) = self.agent.current_location
+        action = self.agent.action_taken
+        # every Q value changed since the previous notification (the notifications may be throttled)
+        q_updates = {(k, l, a): self.agent.Q[k][l][a] for (k, l, a) in self.agent.changed_Q}
+        self.agent.changed_Q.clear()
+        self.channel.publish((i, j), action, self.agent.current_episode, q_updates)
 
     def export(self):
         """
-        Exports the Q values in a file (JSON format).
+        Exports the Q values in a file (JSON format, or the binary format if the file ends with .qmodel).
         """
         filename = filedialog.asksaveasfilename(initialdir=".",
                                                 title="Select file",
-                                                filetypes=(("Fichier JSON", "*.json"), ("Tous les fichiers", "*.*")))
-        with open(filename, 'w') as outfile:
-            json.dump({
-                "q_values": self.agent.Q,
-                "labyrinth": self.labyrinth.adjacency_matrix
-                },
-                outfile,
-                sort_keys=True,
-                indent=4,
-                ensure_ascii=False)
+                                                filetypes=(("Fichier JSON", "*.json"),
+                                                           ("Binary model", "*" + ModelIO.BINARY_EXTENSION),
+                                                           ("Tous les fichiers", "*.*")))
+        ModelIO.save_model(filename, self.agent.Q, self.labyrinth, ModelIO.agent_metadata(self.agent))
 
     def import_model(self):
         filename = filedialog.askopenfilename(initialdir=".",
                                               title="Select file",
-                                              filetypes=(("Fichier JSON", "*.json"), ("Tous les fichiers", "*.*")))
-        with open(filename, 'r') as infile:
-            x = json.load(infile)
-            self.labyrinth.adjacency_matrix = x["labyrinth"]
-            self.agent.Q = x["q_values"]
-        self.action_values = []
-        self.canvas.delete("all")
+                                              filetypes=(("Fichier JSON", "*.json"),
+                                                         ("Binary model", "*" + ModelIO.BINARY_EXTENSION),
+                                                         ("Tous les fichiers", "*.*")))
+        self.stop_worker()
+        model = ModelIO.load_model(filename)
+        if not self.replace_labyrinth(model["labyrinth"]):
+            return
+        self.agent.load_Q(ArrayQTable.from_array(model["q_values"], self.labyrinth, copy=False))
+        if "rng" in model["metadata"]:
+            # the agent continues with the random stream it was trained with
+            self.agent.rng = RandomStream(**model["metadata"]["rng"])
         self.update_canvas_size()
-        self.draw_grid()
-        if self.position_agent_gui is not None:
-            self.canvas.delete(self.position_agent_gui)
-            self.position_agent_gui = None
-        self.draw_agent()
+        self.draw_labyrinth()
         self.stop()
 
     def import_labyrinth(self):
         filename = filedialog.askopenfilename(initialdir=".",
                                               title="Select file",
-                                              filetypes=(("Labyrinth map", "*.map"), ("Tous les fichiers", "*.*")))
-        with open(filename, 'r') as infile:
-            self.labyrinth.adjacency_matrix = []
-            for line in infile.readlines():
-                self.labyrinth.adjacency_matrix.append([int(x) for x in line.split(",")])
-        self.action_values = []
+                                              filetypes=(("Labyrinth map", "*.map"),
+                                                         ("Binary labyrinth map", "*.npy"),
+                                                         ("Tous les fichiers", "*.*")))
+        self.stop_worker()
+        if not self.replace_labyrinth(MapLoader.load_map(filename)):
+            return
         self.agent.init_Q()
-        self.canvas.delete("all")
         self.update_canvas_size()
-        self.draw_grid()
-        if self.position_agent_gui is not None:
-            self.canvas.delete(self.position_agent_gui)
-            self.position_agent_gui = None
-        self.draw_agent()
+        self.draw_labyrinth()
         self.stop()
 
+    def replace_labyrinth(self, grid):
+        """
+        Replaces the map of the labyrinth (shared with the agent). The start cell of the agent is checked on the new
+        map: if no episode can start there, the agent starts from the first cell that leads to the goal.
+        :param grid: The new map
+        :return: False if no cell of the new map leads to the goal: the map is refused and the labyrinth unchanged
+        """
+        previous = self.labyrinth.adjacency_matrix
+        # the labyrinth rebuilds its lookup tables when its matrix is replaced
+        self.labyrinth.adjacency_matrix = grid
+        candidates = self.labyrinth.start_candidates
+        if not len(candidates):
+            self.labyrinth.adjacency_matrix = previous
+            messagebox.showerror("Labyrinthe magique", "No cell of this labyrinth leads to the goal, "
+                                                       "it was not loaded.")
+            return False
+        if not self.labyrinth.is_start_candidate(*self.agent.start_cell):
+            start_cell = divmod(int(candidates[0]), self.labyrinth.width)
+            messagebox.showwarning("Labyrinthe magique", "The start cell " + str(self.agent.start_cell)
+                                   + " is a rock or does not lead to the goal in this labyrinth, the agent starts"
+                                   + " from " + str(start_cell) + " instead.")
+            self.agent.start_cell = start_cell
+        return True
+
     def update_canvas_size(self):
-        self.width = self.square_width * len(self.labyrinth.adjacency_matrix[0])  # the dimension
-        self.height = self.square_height * len(self.labyrinth.adjacency_matrix)  # the dimension
-        self.canvas.config(width=self.width, height=self.height)
+        if self.is_large():
+            self.width = self.height = self.viewport
+        else:
+            self.width = self.square_width * len(self.labyrinth.adjacency_matrix[0])  # the dimension
+            self.height = self.square_height * len(self.labyrinth.adjacency_matrix)  # the dimension
+        if hasattr(self, "canvas"):
+            self.canvas.config(width=self.width, height=self.height)
 
     def draw_agent(self):
-        self.position_agent_gui = self.canvas.create_image(0 * self.square_width + 20,
-                                                           (0 + self.c) * self.square_height + 20,
+        (i, j) = self.agent.start_cell
+        if self.position_agent_gui is not None:
+            self.update_position_agent((i, j))
+            self.canvas.tag_raise(self.position_agent_gui)
+            return
+        self.position_agent_gui = self.canvas.create_image(j * self.square_width + 20,
+                                                           (i + self.c) * self.square_height + 20,
                                                            image=self.res["pikachu"],
                                                            anchor='nw')
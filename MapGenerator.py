@@ -0,0 +1,204 @@
+"""
+Procedural labyrinths for the scaling tests, in the cell encoding of the shipped maps
+(0 rock, 1 free, 2 trap, -1 goal). The agent always starts in (0, 0), which is free, and the goal is reachable
+from it: the generated maps are solvable by construction, and reachable() can check any map.
+
+Two styles are available:
+    - maze: a sidewinder maze (a spanning tree of corridors, built row-wise with array operations).
+      The corridors are corridor_width cells wide, and a fraction of the walls can be removed to create loops.
+    - cave: rocks scattered with a given density, plus a random monotone path from (0, 0) to the bottom-right corner.
+
+Example:
+    python MapGenerator.py 1000 1000 --style maze --trap-density 0.02 --loops 0.1 --seed 0 --output maze1000
+    (writes maze1000.map and maze1000.npy)
+"""
+import argparse
+
+import numpy
+
+import MapLoader
+from Labyrinth import Labyrinth
+
+STYLES = ("maze", "cave")
+
+
+def sidewinder(rows, columns, rng):
+    """
+    Builds a sidewinder maze on a rows x columns lattice of cells.
+    :return: (east, north) boolean arrays: east[r, c] if (r, c) is open to (r, c + 1),
+             north[r, c] if (r, c) is open to (r - 1, c)
+    """
+    east = rng.random((rows, columns)) < 0.5
+    east[0] = True
+    east[:, -1] = False
+    north = numpy.zeros((rows, columns), dtype=bool)
+    if rows > 1:
+        # in each row but the first, every run of cells joined eastward is opened north in one random cell
+        ends = ~east[1:]
+        run = numpy.cumsum(ends, axis=1) - ends + numpy.arange(rows - 1)[:, None] * columns
+        keys = rng.random(run.shape)
+        order = numpy.lexsort((keys.ravel(), run.ravel()))
+        sorted_runs = run.ravel()[order]
+        last = numpy.append(sorted_runs[1:] != sorted_runs[:-1], True)
+        north.ravel()[order[last] + columns] = True
+    return east, north
+
+
+def maze(height, width, rng, corridor_width=1, loops=0.0):
+    """
+    Generates a maze whose corridors are corridor_width cells wide and whose walls are one cell thick.
+    The rows and columns which do not fit a whole corridor are filled with rock.
+    :param {float} loops: Fraction of the inner walls removed (0 gives a perfect maze, without cycles)
+    :return: A (height, width) int8 array of rocks and free cells
+    """
+    step = corridor_width + 1
+    (rows, columns) = ((height + 1) // step, (width + 1) // step)
+    if rows < 1 or columns < 1:
+        raise ValueError("The labyrinth must be at least as large as a corridor !")
+    east, north = sidewinder(rows, columns, rng)
+
+    lattice = numpy.zeros((2 * rows - 1, 2 * columns - 1), dtype=numpy.int8)
+    lattice[::2, ::2] = 1
+    lattice[::2, 1::2] = east[:, :-1]
+    lattice[1::2, ::2] = north[1:]
+    if loops > 0:
+        walls = numpy.zeros(lattice.shape, dtype=bool)
+        walls[::2, 1::2] = True
+        walls[1::2, ::2] = True
+        walls &= lattice == 0
+        lattice[walls & (rng.random(lattice.shape) < loops)] = 1
+
+    # the cells of the lattice are corridor_width wide, the walls between them one cell
+    repeats_rows = numpy.where(numpy.arange(lattice.shape[0]) % 2 == 0, corridor_width, 1)
+    repeats_columns = numpy.where(numpy.arange(lattice.shape[1]) % 2 == 0, corridor_width, 1)
+    grid = numpy.zeros((height, width), dtype=numpy.int8)
+    block = lattice.repeat(repeats_rows, axis=0).repeat(repeats_columns, axis=1)
+    grid[:block.shape[0], :block.shape[1]] = block
+    return grid
+
+
+def cave(height, width, rng, rock_density=0.3):
+    """
+    Generates rocks scattered with a given density, plus a random monotone path (right and down moves)
+    from (0, 0) to (height - 1, width - 1).
+    :return: A (height, width) int8 array of rocks and free cells
+    """
+    grid = (rng.random((height, width)) >= rock_density).astype(numpy.int8)
+    moves = numpy.zeros(height + width - 2, dtype=numpy.int64)
+    moves[rng.permutation(len(moves))[:height - 1]] = 1
+    rows = numpy.concatenate(([0], numpy.cumsum(moves)))
+    columns = numpy.arange(len(rows)) - rows
+    grid[rows, columns] = 1
+    return grid
+
+
+def distances(grid, start=(0, 0)):
+    """
+    Breadth-first search over the non-rock cells, one frontier at a time (see Labyrinth.distances).
+    :param grid: A (height, width) map
+    :param start: The first cell
+    :return: A (height, width) int32 array of the number of moves from start (-1 for the unreachable cells)
+    """
+    labyrinth = Labyrinth(numpy.asarray(grid))
+    return labyrinth.distances([labyrinth.state_index(*start)])
+
+
+def reachable(grid, start=(0, 0)):
+    """
+    :return: A (height, width) boolean array of the cells reachable from start
+    """
+    return distances(grid, start) >= 0
+
+
+def is_solvable(grid, start=(0, 0)):
+    """
+    :return: True if start is free and a goal can be reached from it
+    """
+    grid = numpy.asarray(grid)
+    return bool((reachable(grid, start) & (grid == -1)).any())
+
+
+def generate(height, width, seed=None, style="maze", trap_density=0.05, corridor_width=1, loops=0.0,
+             rock_density=0.3, goal="corner", fill_unreachable=True):
+    """
+    Generates a solvable labyrinth.
+    :param {int} height: Number of rows
+    :param {int} width: Number of columns
+    :param {int} seed: Seed of the generator (the same seed gives the same map)
+    :param {str} style: Possible values: maze|cave
+    :param {float} trap_density: Probability of each free cell to be a trap ((0, 0) and the goal never are)
+    :param {int} corridor_width: maze style: width of the corridors
+    :param {float} loops: maze style: fraction of the inner walls removed to create cycles
+    :param {float} rock_density: cave style: probability of each cell to be a rock
+    :param {str} goal: Possible values: corner|far (corner: the reachable cell closest to the bottom-right corner,
+                       far: the reachable cell the farthest from (0, 0), which needs a breadth-first search)
+    :param {bool} fill_unreachable: If True, the free cells that cannot be reached from (0, 0) become rocks
+    :return: A (height, width) int8 array
+    """
+    if height < 1 or width < 1 or height * width < 2:
+        raise ValueError("The labyrinth must have room for both the start and the goal !")
+    if trap_density < 0 or trap_density > 1:
+        raise ValueError("Trap density must be in range [0, 1] !")
+    if corridor_width < 1:
+        raise ValueError("Corridor width must be at least 1 !")
+    if goal not in ('corner', 'far'):
+        raise ValueError("Goal must be corner or far !")
+    rng = numpy.random.default_rng(seed)
+    if style == 'maze':
+        grid = maze(height, width, rng, corridor_width, loops)
+    elif style == 'cave':
+        grid = cave(height, width, rng, rock_density)
+    else:
+        raise ValueError("Style must be maze or cave !")
+
+    distance = None
+    if fill_unreachable or goal == 'far':
+        distance = distances(grid)
+        if fill_unreachable:
+            grid[distance < 0] = 0
+    if goal == 'far':
+        goal_index = int(distance.argmax())
+    else:
+        # the free cell with the largest i + j, the lowest one among them
+        cells = numpy.flatnonzero(grid.ravel())
+        rows, columns = numpy.divmod(cells, width)
+        goal_index = int(cells[numpy.lexsort((rows, rows + columns))[-1]])
+
+    if goal_index == 0:
+        raise ValueError("The labyrinth is too small for its corridors: the goal cannot be placed !")
+    traps = (grid == 1) & (rng.random(grid.shape) < trap_density)
+    traps[0, 0] = False
+    grid[traps] = 2
+    grid.ravel()[goal_index] = -1
+    return grid
+
+
+def write_map(grid, path):
+    """
+    Writes a map in the CSV .map format and in the binary .npy format.
+    :param grid: A (height, width) map
+    :param {str} path: The path of the files, without extension
+    :return: (path of the .map file, path of the .npy file)
+    """
+    MapLoader.save_csv_map(grid, path + ".map")
+    MapLoader.save_binary_map(grid, path + MapLoader.BINARY_EXTENSION)
+    return path + ".map", path + MapLoader.BINARY_EXTENSION
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generates a solvable labyrinth.")
+    parser.add_argument("height", type=int)
+    parser.add_argument("width", type=int)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--style", default="maze", choices=STYLES)
+    parser.add_argument("--trap-density", type=float, default=0.05)
+    parser.add_argument("--corridor-width", type=int, default=1)
+    parser.add_argument("--loops", type=float, default=0.0, help="maze style: fraction of the walls removed")
+    parser.add_argument("--rock-density", type=float, default=0.3, help="cave style")
+    parser.add_argument("--goal", default="corner", choices=["corner", "far"])
+    parser.add_argument("--output", required=True, help="path of the .map and .npy files, without extension")
+    args = parser.parse_args()
+
+    grid = generate(args.height, args.width, args.seed, args.style, args.trap_density, args.corridor_width,
+                    args.loops, args.rock_density, args.goal)
+    print("written to %s and %s" % write_map(grid, args.output))
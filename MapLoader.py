@@ -0,0 +1,91 @@
+"""
+Loading and saving of the labyrinth maps, independently of the GUI.
+
+Two formats are supported:
+    - .map: the CSV text format of the shipped maps (one row per line, cells separated by commas).
+      It is parsed line by line into a compact int8 array.
+    - .npy: a binary int8 array (NumPy format), opened with mmap at no parse cost.
+"""
+import numpy
+
+BINARY_EXTENSION = ".npy"
+
+
+def load_csv_map(path):
+    """
+    Parses a CSV .map file line by line into an int8 array.
+    :param {str} path: The path of the .map file
+    :return: A (height, width) int8 array
+    """
+    cells = bytearray()
+    width = None
+    height = 0
+    with open(path, 'r') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            # parsed wide and checked before the cast: an int8 parse would wrap 257 around to a free cell
+            try:
+                row = numpy.fromstring(line, dtype=numpy.int64, sep=",")
+            except ValueError:
+                raise ValueError("Invalid row " + str(height + 1) + " in " + path)
+            if width is None:
+                width = len(row)
+            if len(row) != width or len(row) != line.count(",") + 1:
+                raise ValueError("Invalid row " + str(height + 1) + " in " + path)
+            if len(row) and (row.min() < -128 or row.max() > 127):
+                raise ValueError("Cell value out of range in row " + str(height + 1) + " in " + path)
+            cells.extend(row.astype(numpy.int8).tobytes())
+            height += 1
+    if not height:
+        raise ValueError("Empty map: " + path)
+    return numpy.frombuffer(cells, dtype=numpy.int8).reshape(height, width)
+
+
+def load_binary_map(path, mmap=True):
+    """
+    Opens a binary map.
+    :param {str} path: The path of the .npy file
+    :param {bool} mmap: If True, the file is memory-mapped (read-only) instead of read
+    :return: A (height, width) int8 array
+    """
+    grid = numpy.load(path, mmap_mode='r' if mmap else None)
+    if grid.dtype != numpy.int8 or grid.ndim != 2:
+        raise ValueError("A binary map must be a 2D int8 array: " + path)
+    return grid
+
+
+def load_map(path, mmap=True):
+    """
+    Loads a map in either format, chosen from the extension of the file.
+    :param {str} path: The path of the .map or .npy file
+    :param {bool} mmap: If True, a binary map is memory-mapped
+    :return: A (height, width) int8 array
+    """
+    if path.endswith(BINARY_EXTENSION):
+        return load_binary_map(path, mmap)
+    return load_csv_map(path)
+
+
+def save_csv_map(grid, path):
+    """
+    Writes a map in the CSV .map format, row by row.
+    :param grid: A (height, width) array or list of lists
+    :param {str} path: The path of the .map file
+    """
+    grid = numpy.asarray(grid, dtype=numpy.int8)
+    with open(path, 'w') as outfile:
+        for i, row in enumerate(grid):
+            if i:
+                outfile.write("\n")
+            outfile.write(",".join(str(cell) for cell in row.tolist()))
+
+
+def save_binary_map(grid, path):
+    """
+    Writes a map in the binary format.
+    :param grid: A (height, width) array or list of lists
+    :param {str} path: The path of the .npy file
+    """
+    with open(path, 'wb') as outfile:
+        numpy.save(outfile, numpy.asarray(grid, dtype=numpy.int8))
@@ -0,0 +1,123 @@
+"""
+Instrumentation of the training loop.
+
+An agent created with a metrics sink (Agent(..., metrics=sink)) writes one record per episode of learn()
+and optimal_play() (see EPISODE_FIELDS): steps, return, trap hits, largest |ΔQ| and the time spent in the
+policy, the environment, the Q update and the observers. The sinks buffer the records and write them
+in batches, as JSON lines or CSV rows.
+
+profile() wraps any code with cProfile or tracemalloc.
+"""
+import cProfile
+import csv
+import json
+import tracemalloc
+from contextlib import contextmanager
+
+EPISODE_FIELDS = ["phase", "episode", "steps", "return", "trap_hits", "max_abs_delta", "policy_time",
+                  "environment_time", "update_time", "observer_time", "wall_time", "steps_per_second"]
+# Phases of the agent whose episodes are timed
+TIMED_PHASES = ("policy", "environment", "update", "observer")
+
+
+class JsonlSink:
+    """
+    Writes the records as JSON lines, buffer_size records at a time.
+    """
+
+    def __init__(self, path, buffer_size=100):
+        """
+        :param {str} path: The path of the .jsonl file (overwritten)
+        :param {int} buffer_size: Number of records kept in memory before they are written
+        """
+        self.outfile = open(path, 'w')
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.outfile.write("".join(json.dumps(record) + "\n" for record in self.buffer))
+            self.buffer = []
+        self.outfile.flush()
+
+    def close(self):
+        self.flush()
+        self.outfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvSink(JsonlSink):
+    """
+    Writes the records as CSV rows, buffer_size records at a time.
+    """
+
+    def __init__(self, path, buffer_size=100, fields=EPISODE_FIELDS):
+        """
+        :param {str} path: The path of the .csv file (overwritten)
+        :param {int} buffer_size: Number of records kept in memory before they are written
+        :param {list} fields: The columns (the other keys of the records are ignored)
+        """
+        JsonlSink.__init__(self, path, buffer_size)
+        self.writer = csv.DictWriter(self.outfile, fieldnames=fields, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.writerows(self.buffer)
+            self.buffer = []
+        self.outfile.flush()
+
+
+def open_sink(path, buffer_size=100):
+    """
+    :param {str} path: The path of the metrics file, CSV if it ends with .csv, JSON lines otherwise
+    :param {int} buffer_size: Number of records kept in memory before they are written
+    :return: A JsonlSink or a CsvSink
+    """
+    if path.endswith(".csv"):
+        return CsvSink(path, buffer_size)
+    return JsonlSink(path, buffer_size)
+
+
+@contextmanager
+def profile(kind, path, limit=30):
+    """
+    Profiles the code of the with block.
+    :param {str} kind: Possible values: cprofile|tracemalloc
+                       (cprofile: the statistics are dumped to path, to be read with pstats or snakeviz,
+                        tracemalloc: the limit lines which allocated the most memory are written to path)
+    :param {str} path: The output file
+    :param {int} limit: Number of lines of the tracemalloc report
+    """
+    if kind == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    elif kind == 'tracemalloc':
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            (current, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(path, 'w') as outfile:
+                outfile.write("current: %d bytes, peak: %d bytes\n" % (current, peak))
+                for statistic in snapshot.statistics('lineno')[:limit]:
+                    outfile.write(str(statistic) + "\n")
+    else:
+        raise ValueError("Profiler must be cprofile or tracemalloc !")
@@ -0,0 +1,249 @@
+"""
+Serialization of the trained models, independently of the GUI.
+
+A model is a dict:
+    - "labyrinth": the (height, width) int8 map
+    - "q_values": the (height, width, 4) float Q array (-inf for the impossible actions, see QTable.ArrayQTable)
+    - "metadata": a dict (hyperparameters, random stream, number of episodes, ...)
+
+Two formats are supported, chosen from the extension of the file:
+    - .json: the layout of the GUI export (q_values as nested lists of dicts, indent=4)
+    - .qmodel: a binary format that is memory-mapped when loaded:
+        magic (8 bytes) | header length (uint32, little endian) | JSON header | padding
+        | int8 map | padding | float32 or float64 Q values
+      The header holds the shapes, the dtype, the offsets of the arrays and the metadata.
+      The arrays are aligned on 64 bytes.
+"""
+import json
+import os
+import struct
+
+import numpy
+
+from Labyrinth import Labyrinth
+from QTable import ArrayQTable, SparseQTable
+
+BINARY_EXTENSION = ".qmodel"
+MAGIC = b"LABQMDL\x00"
+ALIGNMENT = 64
+VERSION = 1
+
+
+def agent_metadata(agent):
+    """
+    :param {Agent.Agent} agent: A trained agent
+    :return: The metadata of its model: hyperparameters, random stream and number of episodes played
+    """
+    summary = agent.training_summary
+    return {
+        "policy": agent.policy,
+        "exploration_rate": agent.exploration_rate,
+        "temperature": agent.temperature,
+        "learning_rate": agent.learning_rate,
+        "discount_rate": agent.discount_rate,
+        "nb_episodes": agent.nb_episodes,
+        "episodes": summary["episodes"] if summary is not None else 0,
+        "rng": agent.rng.describe()
+    }
+
+
+def q_array(q_values, labyrinth, dtype=numpy.float64):
+    """
+    :param q_values: Q values as a QTable.ArrayQTable, a QTable.SparseQTable, an array or in the nested
+                     list-of-dicts layout
+    :param {Labyrinth.Labyrinth} labyrinth: The labyrinth the Q values are defined on
+    :return: The (height, width, 4) Q array
+    """
+    if isinstance(q_values, SparseQTable):
+        return q_values.to_array().astype(dtype, copy=False)
+    if isinstance(q_values, ArrayQTable):
+        return q_values.values.astype(dtype, copy=False)
+    if isinstance(q_values, numpy.ndarray):
+        return ArrayQTable.from_array(q_values.astype(dtype, copy=False), labyrinth).values
+    return ArrayQTable.from_dict(q_values, labyrinth, dtype).values
+
+
+def save_model(path, q_values, labyrinth, metadata=None, dtype=numpy.float32):
+    """
+    Saves a model, in the binary format if path ends with .qmodel, in JSON otherwise.
+    :param {str} path: The path of the file
+    :param q_values: Q values as a QTable.ArrayQTable, an array or in the nested list-of-dicts layout
+    :param {Labyrinth.Labyrinth} labyrinth: The labyrinth the Q values are defined on
+    :param {dict} metadata: Metadata of the model (see agent_metadata)
+    :param dtype: Float type of the Q values in the binary format (numpy.float32 or numpy.float64)
+    """
+    if path.endswith(BINARY_EXTENSION):
+        save_binary_model(path, q_array(q_values, labyrinth, dtype), labyrinth.grid, metadata)
+    else:
+        if not isinstance(q_values, list):
+            q_values = ArrayQTable.from_array(q_array(q_values, labyrinth), labyrinth).to_dict()
+        save_json_model(path, q_values, labyrinth.grid.tolist(), metadata)
+
+
+def load_model(path, mmap=True):
+    """
+    Loads a model in either format.
+    :param {str} path: The path of the file
+    :param {bool} mmap: If True, the arrays of a binary model are memory-mapped (copy-on-write)
+    :return: The model dict (labyrinth, q_values, metadata)
+    """
+    if path.endswith(BINARY_EXTENSION):
+        return load_binary_model(path, mmap)
+    x = load_json_model(path)
+    labyrinth = Labyrinth(x["labyrinth"])
+    return {
+        "labyrinth": labyrinth.grid,
+        "q_values": q_array(x["q_values"], labyrinth),
+        "metadata": x["metadata"]
+    }
+
+
+def save_json_model(path, q_values, labyrinth, metadata=None):
+    """
+    Writes a model with the layout of the GUI export.
+    :param {str} path: The path of the .json file
+    :param q_values: Q values in the nested list-of-dicts layout
+    :param labyrinth: The map as a list of lists
+    :param {dict} metadata: Metadata of the model, its random stream is stored under "rng"
+    """
+    model = {
+        "q_values": q_values,
+        "labyrinth": labyrinth
+    }
+    metadata = dict(metadata or {})
+    if "rng" in metadata:
+        model["rng"] = metadata.pop("rng")
+    if metadata:
+        model["metadata"] = metadata
+    with open(path, 'w') as outfile:
+        json.dump(model,
+                  outfile,
+                  sort_keys=True,
+                  indent=4,
+                  ensure_ascii=False)
+
+
+def load_json_model(path):
+    """
+    Reads a model with the layout of the GUI export.
+    :param {str} path: The path of the .json file
+    :return: A dict with the q_values (nested list-of-dicts layout), the labyrinth (list of lists) and the metadata
+    """
+    with open(path, 'r') as infile:
+        x = json.load(infile)
+    metadata = dict(x.get("metadata", {}))
+    if "rng" in x:
+        metadata["rng"] = x["rng"]
+    return {
+        "q_values": x["q_values"],
+        "labyrinth": x["labyrinth"],
+        "metadata": metadata
+    }
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_binary_model(path, q_values, grid, metadata=None):
+    """
+    Writes a model in the binary format.
+    :param {str} path: The path of the .qmodel file
+    :param q_values: The (height, width, 4) float32 or float64 Q array
+    :param grid: The (height, width) map
+    :param {dict} metadata: Metadata of the model
+    """
+    grid = numpy.ascontiguousarray(grid, dtype=numpy.int8)
+    q_values = numpy.ascontiguousarray(q_values)
+    if q_values.dtype not in (numpy.float32, numpy.float64):
+        raise ValueError("The Q values must be float32 or float64 !")
+    if q_values.shape[:2] != grid.shape:
+        raise ValueError("The Q values and the map must have the same shape !")
+
+    header = {"version": VERSION, "shape": list(grid.shape), "q_dtype": q_values.dtype.name,
+              "metadata": metadata or {}}
+    # the offsets depend on the header length, which depends on the offsets: they are given a fixed width
+    header["map_offset"] = header["q_offset"] = 10 ** 18
+    header_length = len(json.dumps(header).encode("utf-8"))
+    header["map_offset"] = _aligned(len(MAGIC) + 4 + header_length)
+    header["q_offset"] = _aligned(header["map_offset"] + grid.nbytes)
+    encoded = json.dumps(header).encode("utf-8").ljust(header_length)
+
+    with open(path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(struct.pack("<I", header_length))
+        outfile.write(encoded)
+        outfile.seek(header["map_offset"])
+        outfile.write(grid.tobytes())
+        outfile.seek(header["q_offset"])
+        outfile.write(q_values.astype(q_values.dtype.newbyteorder("<"), copy=False).tobytes())
+
+
+def read_binary_header(path):
+    """
+    :param {str} path: The path of the .qmodel file
+    :return: The header of a binary model
+    """
+    with open(path, 'rb') as infile:
+        if infile.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a binary model: " + path)
+        (header_length,) = struct.unpack("<I", infile.read(4))
+        header = json.loads(infile.read(header_length).decode("utf-8"))
+    if header["version"] != VERSION:
+        raise ValueError("Unsupported binary model version: " + str(header["version"]))
+    return header
+
+
+def load_binary_model(path, mmap=True):
+    """
+    Reads a model in the binary format.
+    :param {str} path: The path of the .qmodel file
+    :param {bool} mmap: If True, the arrays are memory-mapped in copy-on-write mode (the model can be trained
+                        further without modifying the file), otherwise they are read in memory
+    :return: The model dict (labyrinth, q_values, metadata)
+    """
+    header = read_binary_header(path)
+    (height, width) = header["shape"]
+    q_dtype = numpy.dtype(header["q_dtype"]).newbyteorder("<")
+    if mmap:
+        grid = numpy.memmap(path, dtype=numpy.int8, mode='c', offset=header["map_offset"], shape=(height, width))
+        q_values = numpy.memmap(path, dtype=q_dtype, mode='c', offset=header["q_offset"], shape=(height, width, 4))
+    else:
+        with open(path, 'rb') as infile:
+            infile.seek(header["map_offset"])
+            grid = numpy.fromfile(infile, dtype=numpy.int8, count=height * width).reshape(height, width)
+            infile.seek(header["q_offset"])
+            q_values = numpy.fromfile(infile, dtype=q_dtype, count=height * width * 4).reshape(height, width, 4)
+    return {
+        "labyrinth": grid,
+        "q_values": q_values,
+        "metadata": header["metadata"]
+    }
+
+
+def json_to_binary(json_path, binary_path=None, dtype=numpy.float32):
+    """
+    Converts a JSON model to the binary format.
+    :param {str} json_path: The path of the .json model
+    :param {str} binary_path: The path of the .qmodel file (json_path with the .qmodel extension by default)
+    :param dtype: Float type of the Q values
+    :return: The path of the binary model
+    """
+    binary_path = binary_path or os.path.splitext(json_path)[0] + BINARY_EXTENSION
+    model = load_model(json_path)
+    save_binary_model(binary_path, model["q_values"].astype(dtype), model["labyrinth"], model["metadata"])
+    return binary_path
+
+
+def binary_to_json(binary_path, json_path=None):
+    """
+    Converts a binary model to the JSON layout of the GUI export.
+    :param {str} binary_path: The path of the .qmodel file
+    :param {str} json_path: The path of the .json model (binary_path with the .json extension by default)
+    :return: The path of the JSON model
+    """
+    json_path = json_path or os.path.splitext(binary_path)[0] + ".json"
+    model = load_binary_model(binary_path, mmap=False)
+    labyrinth = Labyrinth(model["labyrinth"])
+    save_model(json_path, model["q_values"].astype(numpy.float64), labyrinth, model["metadata"])
+    return json_path
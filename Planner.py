@@ -0,0 +1,144 @@
+"""
+Model-based solvers. The labyrinth is fully known and deterministic, so its optimal Q values can be computed
+directly from the lookup tables of Labyrinth.Labyrinth (next_state, rewards, valid, terminal) with a few
+vectorized sweeps, instead of being sampled by Q-learning.
+
+The Q values follow the conventions of Agent.update_state: Q(s, a) = r(s, a) + discount_rate * V(s'),
+where V(s') is the best Q value of s' and V is 0 in the goal (the episode ends there).
+"""
+import numpy
+
+from QTable import ArrayQTable, SparseQTable
+
+
+def _bellman(environment, discount_rate, values):
+    """
+    :return: The Q values obtained from the state values in one Bellman backup (-inf for the impossible actions,
+             0 in the goal where Q-learning never updates them)
+    """
+    q = numpy.where(environment.valid,
+                    environment.rewards + discount_rate * values[environment.next_state],
+                    -numpy.inf)
+    q[environment.terminal] = numpy.where(environment.valid[environment.terminal], 0.0, -numpy.inf)
+    return q
+
+
+def _state_values(environment, q):
+    """
+    :return: The value of each state: its best Q value, 0 in the goal and in the cells without possible actions
+    """
+    values = q.max(axis=1)
+    values[environment.terminal | ~environment.valid.any(axis=1)] = 0.0
+    return values
+
+
+def value_iteration(environment, discount_rate, tolerance=1e-6, max_iterations=100000):
+    """
+    Computes the optimal Q values by value iteration.
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :param {float} discount_rate: Discount factor, must be in range [0, 1]
+    :param {float} tolerance: The iteration stops when no state value changes by more than this
+    :param {int} max_iterations: Maximum number of sweeps (with discount_rate = 1 the values of the cells that
+                                 cannot reach the goal never converge)
+    :return: (QTable.ArrayQTable of the optimal Q values, number of sweeps)
+    """
+    values = numpy.zeros(environment.height * environment.width)
+    iterations = 0
+    while True:
+        iterations += 1
+        q = _bellman(environment, discount_rate, values)
+        new_values = _state_values(environment, q)
+        delta = numpy.abs(new_values - values).max()
+        values = new_values
+        if delta < tolerance or iterations >= max_iterations:
+            break
+    return ArrayQTable.from_array(q, environment), iterations
+
+
+def policy_iteration(environment, discount_rate, tolerance=1e-6, max_iterations=1000, max_evaluations=100000):
+    """
+    Computes the optimal Q values by policy iteration (iterative policy evaluation, greedy improvement).
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :param {float} discount_rate: Discount factor, must be in range [0, 1]
+    :param {float} tolerance: The evaluation of a policy stops when no state value changes by more than this
+    :param {int} max_iterations: Maximum number of policy improvements
+    :param {int} max_evaluations: Maximum number of sweeps of one policy evaluation
+    :return: (QTable.ArrayQTable of the optimal Q values, number of policy improvements)
+    """
+    states = numpy.arange(environment.height * environment.width)
+    ended = environment.terminal | ~environment.valid.any(axis=1)
+    # first possible action of each state
+    policy = environment.valid.argmax(axis=1)
+    values = numpy.zeros(len(states))
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
+        next_states = environment.next_state[states, policy]
+        rewards = environment.rewards[states, policy]
+        for _ in range(max_evaluations):
+            new_values = numpy.where(ended, 0.0, rewards + discount_rate * values[next_states])
+            delta = numpy.abs(new_values - values).max()
+            values = new_values
+            if delta < tolerance:
+                break
+        q = _bellman(environment, discount_rate, values)
+        # the current action is kept unless another one is strictly better, otherwise ties could cycle
+        improved = q.argmax(axis=1)
+        better = q[states, improved] > q[states, policy] + tolerance
+        if not better.any():
+            break
+        policy = numpy.where(better, improved, policy)
+    return ArrayQTable.from_array(_bellman(environment, discount_rate, values), environment), iterations
+
+
+def solve(environment, discount_rate, method="value-iteration", **kwargs):
+    """
+    Computes the optimal Q values of a labyrinth.
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :param {float} discount_rate: Discount factor, must be in range [0, 1]
+    :param {str} method: Possible values: value-iteration|policy-iteration
+    :return: A QTable.ArrayQTable (use to_dict() for the JSON models and the dict backend of Agent)
+    """
+    if discount_rate < 0 or discount_rate > 1:
+        raise ValueError("Discount rate must be in range [0, 1] !")
+    if method == 'value-iteration':
+        return value_iteration(environment, discount_rate, **kwargs)[0]
+    if method == 'policy-iteration':
+        return policy_iteration(environment, discount_rate, **kwargs)[0]
+    raise ValueError("Method must be value-iteration or policy-iteration !")
+
+
+def distance_to_optimum(q_values, optimal, environment, tolerance=1e-6):
+    """
+    Measures how far learned Q values are from the optimal ones.
+    :param q_values: The learned Q values, as a QTable.ArrayQTable, a QTable.SparseQTable or in the nested
+                     list-of-dicts layout
+    :param {QTable.ArrayQTable} optimal: The optimal Q values (see solve)
+    :param {Labyrinth.Labyrinth} environment: The labyrinth
+    :param {float} tolerance: Two Q values closer than this are considered equal
+    :return: A dict with the max and mean absolute errors on the possible actions, the fraction of the states
+             where the learned greedy action is optimal, and the regret of the greedy action in (0, 0)
+    """
+    if isinstance(q_values, SparseQTable):
+        q_values = ArrayQTable.from_array(q_values.to_array(), environment)
+    elif not isinstance(q_values, ArrayQTable):
+        q_values = ArrayQTable.from_dict(q_values, environment)
+    learned = q_values.values.reshape(-1, optimal.values.shape[-1])
+    best = optimal.values.reshape(learned.shape)
+    # the Q values of the goal are never updated, they are left out
+    valid = environment.valid & ~environment.terminal[:, None]
+    errors = numpy.abs(learned[valid] - best[valid])
+
+    decision_states = numpy.flatnonzero(valid.any(axis=1) & ~environment.terminal)
+    greedy = learned[decision_states].argmax(axis=1)
+    greedy_values = best[decision_states, greedy]
+    optimal_values = best[decision_states].max(axis=1)
+    agreement = greedy_values >= optimal_values - tolerance
+
+    start = decision_states == 0
+    return {
+        "max_abs_error": float(errors.max()) if errors.size else 0.0,
+        "mean_abs_error": float(errors.mean()) if errors.size else 0.0,
+        "policy_agreement": float(agreement.mean()) if agreement.size else 1.0,
+        "start_regret": float((optimal_values - greedy_values)[start][0]) if start.any() else 0.0
+    }
@@ -0,0 +1,334 @@
+from collections.abc import MutableMapping
+
+import numpy
+
+from Labyrinth import ACTION_INDEX, ACTIONS
+
+
+class ArrayQTable:
+    """
+    Dense Q-table backend: a contiguous (height, width, 4) float array indexed by integer actions.
+    Invalid moves (walls, borders, rocks) hold -inf so that a plain argmax/max never picks them;
+    self.mask tells which entries are real Q values. self.flat_values is a flat view of the values for the
+    step-by-step accesses of the agent: Q(s, a) is flat_values[4 * s + a], s = i * width + j.
+    """
+
+    def __init__(self, environment, dtype=numpy.float64):
+        """
+        Creates a Q-table filled with zeros for every possible action of the environment.
+        :param {Labyrinth.Labyrinth} environment: The labyrinth the Q values are defined on
+        :param dtype: The float type of the Q values
+        """
+        self.mask = environment.valid.reshape(environment.height, environment.width, len(ACTIONS)).copy()
+        self.values = numpy.where(self.mask, 0.0, -numpy.inf).astype(dtype)
+        self.flat_values = self.values.reshape(-1)
+
+    @classmethod
+    def from_array(cls, values, environment, copy=True):
+        """
+        Builds a Q-table around existing Q values.
+        :param values: A (height, width, 4) or (height * width, 4) array of Q values (invalid moves are set to -inf)
+        :param {Labyrinth.Labyrinth} environment: The labyrinth the Q values are defined on
+        :param {bool} copy: If False, the table uses the array itself (e.g. a memory-mapped one), which must
+                            already hold -inf for the invalid moves
+        :return: A new ArrayQTable
+        """
+        if not copy:
+            table = cls.__new__(cls)
+            table.mask = environment.valid.reshape(environment.height, environment.width, len(ACTIONS)).copy()
+            table.values = values.reshape(table.mask.shape)
+            table.flat_values = table.values.reshape(-1)
+            return table
+        table = cls(environment, values.dtype)
+        table.values[...] = numpy.where(table.mask, values.reshape(table.values.shape), -numpy.inf)
+        return table
+
+    @classmethod
+    def from_dict(cls, q_values, environment, dtype=numpy.float64):
+        """
+        Builds a Q-table from the nested list-of-dicts layout (the one of the JSON models).
+        :param q_values: q_values[i][j] is a dict {action: value}
+        :param {Labyrinth.Labyrinth} environment: The labyrinth the Q values are defined on
+        :param dtype: The float type of the Q values
+        :return: A new ArrayQTable
+        """
+        table = cls(environment, dtype)
+        for i, row in enumerate(q_values):
+            for j, cell in enumerate(row):
+                for action, value in cell.items():
+                    table.values[i, j, ACTION_INDEX[action]] = value
+        return table
+
+    def to_dict(self):
+        """
+        Converts this table to the nested list-of-dicts layout (the one of the JSON models).
+        :return: A list of lists of dicts {action: value}
+        """
+        height, width, _ = self.values.shape
+        values = self.values.tolist()
+        mask = self.mask.tolist()
+        return [[{action: values[i][j][a] for a, action in enumerate(ACTIONS) if mask[i][j][a]}
+                 for j in range(width)]
+                for i in range(height)]
+
+    def best_action(self, i, j):
+        """
+        :return: The valid action with the maximum Q value in the cell (i, j)
+        """
+        return ACTIONS[self.values[i, j].argmax()]
+
+    def max_value(self, i, j):
+        """
+        :return: The maximum Q value over the valid actions of the cell (i, j)
+        """
+        return self.values[i, j].max()
+
+    def valid_values(self, i, j):
+        """
+        :return: The Q values of the valid actions of the cell (i, j), in the ACTIONS order
+        """
+        return self.values[i, j][self.mask[i, j]]
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, i):
+        """
+        Dict-like access Q[i][j][action], kept for the GUI and the code written against the dict layout.
+        """
+        return _QRow(self, i)
+
+
+class _QRow:
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    def __len__(self):
+        return self.table.values.shape[1]
+
+    def __getitem__(self, j):
+        return QCell(self.table, self.i, j)
+
+
+class QCell(MutableMapping):
+    """
+    View of the Q values of one cell as a dict {action: value} restricted to the valid actions.
+    """
+
+    def __init__(self, table, i, j):
+        self.table = table
+        self.i = i
+        self.j = j
+
+    def __getitem__(self, action):
+        a = ACTION_INDEX[action]
+        if not self.table.mask[self.i, self.j, a]:
+            raise KeyError(action)
+        return float(self.table.values[self.i, self.j, a])
+
+    def __setitem__(self, action, value):
+        a = ACTION_INDEX[action]
+        if not self.table.mask[self.i, self.j, a]:
+            raise KeyError(action)
+        self.table.values[self.i, self.j, a] = value
+
+    def __delitem__(self, action):
+        raise TypeError("The actions of a cell are fixed by the labyrinth.")
+
+    def __iter__(self):
+        return (action for a, action in enumerate(ACTIONS) if self.table.mask[self.i, self.j, a])
+
+    def __len__(self):
+        return int(self.table.mask[self.i, self.j].sum())
+
+
+class SparseQTable:
+    """
+    Sparse Q-table backend for large maps made mostly of rock: only the states reachable from the start states
+    (see Labyrinth.reachable_states) have Q values, stored in a compact (n_states, 4) float array
+    (-inf for the invalid moves, as in ArrayQTable). cells is the sorted array of the flat states s = i * width + j
+    of the rows, searched to find the row of a state. The transitions of the reachable states are also stored by row:
+    next_rows[row, a] is the row of the state reached by the action a (-1 if a is not possible or leaves the goal),
+    so that the memory grows with the number of reachable states, not with the area of the map.
+    The valid moves of the unreachable cells are read as 0, the initial value of the other backends.
+    An agent finds the row of its start cell once per episode, then follows next_rows, and reads its Q values
+    in flat_values (a flat view of values: Q(row, a) is flat_values[4 * row + a]).
+    """
+
+    def __init__(self, environment, starts=(0,), dtype=numpy.float64):
+        """
+        Creates a Q-table filled with zeros for every possible action of the reachable states.
+        :param {Labyrinth.Labyrinth} environment: The labyrinth the Q values are defined on
+        :param starts: The states the episodes can start from (flat indices s = i * width + j)
+        :param dtype: The float type of the Q values
+        """
+        self.height, self.width = environment.height, environment.width
+        self.environment = environment
+        self.cells = environment.reachable_states(starts)
+        (next_states, self.rewards, self.mask) = environment.transitions(self.cells)
+        self.next_rows = self.rows(next_states)
+        self.values = numpy.where(self.mask, 0.0, -numpy.inf).astype(dtype)
+        self.flat_values = self.values.reshape(-1)
+
+    @classmethod
+    def from_array(cls, values, environment, starts=(0,)):
+        """
+        :param values: A (height, width, 4) or (height * width, 4) array of Q values
+        :return: A new SparseQTable holding the Q values of the reachable states
+        """
+        table = cls(environment, starts, values.dtype)
+        rows = values.reshape(-1, len(ACTIONS))[table.cells]
+        table.values[...] = numpy.where(table.mask, rows, -numpy.inf)
+        return table
+
+    @classmethod
+    def from_dict(cls, q_values, environment, starts=(0,), dtype=numpy.float64):
+        """
+        :param q_values: q_values[i][j] is a dict {action: value}
+        :return: A new SparseQTable holding the Q values of the reachable states
+        """
+        table = cls(environment, starts, dtype)
+        for row, s in enumerate(table.cells.tolist()):
+            (i, j) = divmod(s, table.width)
+            for action, value in q_values[i][j].items():
+                table.values[row, ACTION_INDEX[action]] = value
+        return table
+
+    def to_array(self):
+        """
+        :return: The dense (height, width, 4) Q array (the layout of ArrayQTable)
+        """
+        dense = numpy.where(self.environment.valid, 0.0, -numpy.inf).astype(self.values.dtype)
+        dense[self.cells] = self.values
+        return dense.reshape(self.height, self.width, len(ACTIONS))
+
+    def to_dict(self):
+        """
+        Converts this table to the nested list-of-dicts layout (the one of the JSON models).
+        :return: A list of lists of dicts {action: value}
+        """
+        q_values = [[{action: 0.0 for action in self.environment.get_possible_actions(i, j)}
+                     for j in range(self.width)]
+                    for i in range(self.height)]
+        values = self.values.tolist()
+        mask = self.mask.tolist()
+        for row, s in enumerate(self.cells.tolist()):
+            (i, j) = divmod(s, self.width)
+            q_values[i][j] = {action: values[row][a] for a, action in enumerate(ACTIONS) if mask[row][a]}
+        return q_values
+
+    @property
+    def nbytes(self):
+        """
+        :return: The memory used by the Q values, the state indices and the transitions, in bytes
+        """
+        return (self.values.nbytes + self.mask.nbytes + self.cells.nbytes + self.next_rows.nbytes
+                + self.rewards.nbytes)
+
+    def rows(self, states):
+        """
+        :param states: An array of flat states (negative values are left out)
+        :return: The int32 array of their rows (-1 for the states that are not reachable)
+        """
+        states = numpy.asarray(states)
+        rows = numpy.searchsorted(self.cells, states).astype(numpy.int32)
+        found = (states >= 0) & (rows < len(self.cells))
+        found[found] = self.cells[rows[found]] == states[found]
+        return numpy.where(found, rows, numpy.int32(-1))
+
+    def state_id(self, i, j):
+        """
+        :return: The row of the state (i, j), -1 if it is not reachable
+        """
+        s = i * self.width + j
+        row = int(self.cells.searchsorted(s))
+        return row if row < len(self.cells) and self.cells[row] == s else -1
+
+    def state_row(self, i, j):
+        """
+        :return: The row of the reachable state (i, j)
+        """
+        row = self.state_id(i, j)
+        if row < 0:
+            raise ValueError("The state (" + str(i) + ", " + str(j) + ") cannot be reached from the start states !")
+        return row
+
+    def row(self, i, j):
+        """
+        :return: The (4,) Q values of the reachable state (i, j)
+        """
+        return self.values[self.state_row(i, j)]
+
+    def best_action(self, i, j):
+        """
+        :return: The valid action with the maximum Q value in the reachable state (i, j)
+        """
+        return ACTIONS[self.row(i, j).argmax()]
+
+    def max_value(self, i, j):
+        """
+        :return: The maximum Q value over the valid actions of the reachable state (i, j)
+        """
+        return self.row(i, j).max()
+
+    def valid_values(self, i, j):
+        """
+        :return: The Q values of the valid actions of the reachable state (i, j), in the ACTIONS order
+        """
+        row = self.state_row(i, j)
+        return self.values[row][self.mask[row]]
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, i):
+        """
+        Dict-like access Q[i][j][action], kept for the GUI and the code written against the dict layout.
+        """
+        return _SparseQRow(self, i)
+
+
+class _SparseQRow:
+    def __init__(self, table, i):
+        self.table = table
+        self.i = i
+
+    def __len__(self):
+        return self.table.width
+
+    def __getitem__(self, j):
+        return SparseQCell(self.table, self.i, j)
+
+
+class SparseQCell(MutableMapping):
+    """
+    View of the Q values of one cell of a SparseQTable as a dict {action: value} restricted to the valid actions.
+    The cells that cannot be reached hold 0 and cannot be modified.
+    """
+
+    def __init__(self, table, i, j):
+        self.table = table
+        self.i = i
+        self.j = j
+        self.row = table.state_id(i, j)
+        self.actions = table.environment.get_possible_actions(i, j)
+
+    def __getitem__(self, action):
+        if action not in self.actions:
+            raise KeyError(action)
+        return float(self.table.values[self.row, ACTION_INDEX[action]]) if self.row >= 0 else 0.0
+
+    def __setitem__(self, action, value):
+        if action not in self.actions or self.row < 0:
+            raise KeyError(action)
+        self.table.values[self.row, ACTION_INDEX[action]] = value
+
+    def __delitem__(self, action):
+        raise TypeError("The actions of a cell are fixed by the labyrinth.")
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
@@ -0,0 +1,72 @@
+import numpy
+
+
+class RandomStream:
+    """
+    Seeded random number stream. Uniform numbers are drawn from the NumPy generator by blocks and
+    served one by one, which is much cheaper than one generator call per step.
+    A stream is fully described by its seed and its spawn key, so a run can be replayed bit-for-bit
+    and independent child streams can be spawned for parallel workers.
+    """
+
+    def __init__(self, seed=None, spawn_key=(), block_size=4096):
+        """
+        Creates a random stream.
+        :param {int} seed: The seed (a fresh one is drawn from the OS if None)
+        :param {tuple} spawn_key: The spawn key of a child stream (see spawn)
+        :param {int} block_size: Number of uniform numbers drawn at once
+        """
+        self.seed_sequence = numpy.random.SeedSequence(seed, spawn_key=tuple(spawn_key))
+        self.seed = self.seed_sequence.entropy
+        self.spawn_key = tuple(self.seed_sequence.spawn_key)
+        self.generator = numpy.random.Generator(numpy.random.PCG64(self.seed_sequence))
+        self.block_size = block_size
+        self.block = []
+        self.position = 0
+
+    def describe(self):
+        """
+        :return: What is needed to recreate this stream: RandomStream(**stream.describe())
+        """
+        return {"seed": self.seed, "spawn_key": list(self.spawn_key)}
+
+    def get_state(self):
+        """
+        :return: The position of this stream (state of the generator and unused part of the current block),
+                 JSON-serializable. A stream restored with set_state draws the same numbers as this one.
+        """
+        return {"bit_generator": self.generator.bit_generator.state, "block": self.block[self.position:]}
+
+    def set_state(self, state):
+        """
+        Moves this stream to a position saved by get_state.
+        :param {dict} state: The saved position
+        """
+        self.generator.bit_generator.state = state["bit_generator"]
+        self.block = list(state["block"])
+        self.position = 0
+
+    def spawn(self, n):
+        """
+        Creates independent child streams, e.g. one for each parallel worker.
+        :param {int} n: Number of streams
+        :return: A list of n RandomStream
+        """
+        return [RandomStream(self.seed, child.spawn_key, self.block_size) for child in self.seed_sequence.spawn(n)]
+
+    def random(self):
+        """
+        :return: A uniform float in [0, 1)
+        """
+        if self.position == len(self.block):
+            self.block = self.generator.random(self.block_size).tolist()
+            self.position = 0
+        value = self.block[self.position]
+        self.position += 1
+        return value
+
+    def choice(self, sequence):
+        """
+        :return: A uniformly chosen element of a non-empty sequence
+        """
+        return sequence[int(self.random() * len(sequence))]
@@ -0,0 +1,58 @@
+import numpy
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity ring buffer of transitions (state, action, reward, next state), stored in parallel arrays.
+    The states are the flat indices s = i * width + j of Labyrinth.Labyrinth and the actions the indices
+    of Labyrinth.ACTIONS, so that a batch of transitions can be backed up with array operations.
+    When the buffer is full, the oldest transition is overwritten.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param {int} capacity: Maximum number of transitions kept
+        """
+        if capacity < 1:
+            raise ValueError("Replay capacity must be at least 1 !")
+        self.capacity = capacity
+        self.states = numpy.zeros(capacity, dtype=numpy.int32)
+        self.actions = numpy.zeros(capacity, dtype=numpy.int8)
+        self.rewards = numpy.zeros(capacity, dtype=numpy.float64)
+        self.next_states = numpy.zeros(capacity, dtype=numpy.int32)
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state):
+        """
+        Stores a transition.
+        :param {int} state: The flat index of the state
+        :param {int} action: The index of the action
+        :param {float} reward: The reward for taking the action
+        :param {int} next_state: The flat index of the reached state
+        """
+        position = self.position
+        self.states[position] = state
+        self.actions[position] = action
+        self.rewards[position] = reward
+        self.next_states[position] = next_state
+        self.position = position + 1 if position + 1 < self.capacity else 0
+        if self.size < self.capacity:
+            self.size += 1
+
+    def sample(self, generator, batch_size):
+        """
+        Draws transitions uniformly (with replacement).
+        :param generator: A numpy.random.Generator (e.g. RandomStream.generator)
+        :param {int} batch_size: Number of transitions
+        :return: (states, actions, rewards, next_states) arrays
+        """
+        indices = generator.integers(self.size, size=batch_size)
+        return self.states[indices], self.actions[indices], self.rewards[indices], self.next_states[indices]
+
+    def clear(self):
+        self.size = 0
+        self.position = 0
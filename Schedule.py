@@ -0,0 +1,171 @@
+"""
+Schedules of the hyperparameters of Agent (exploration rate, temperature, learning rate).
+
+A schedule is evaluated at each step with schedule(step, episode, visits):
+    - step: number of steps since the agent was created
+    - episode: the current episode (from 1)
+    - visits: the number of visits of the current state (exploration rate, temperature) or of the
+      current (state, action) (learning rate), counted by a VisitCounter
+
+A spec string can be parsed with parse(), e.g. "linear:0.5:0.05:200:episode", "exponential:10:0.5:0.999"
+or "visits:1:0.05".
+"""
+import numpy
+
+from Labyrinth import ACTIONS
+
+UNITS = ("step", "episode")
+
+
+class VisitCounter:
+    """
+    Number of visits of each (state, action) and of each state, in compact uint32 arrays indexed by the
+    flat state s = i * width + j and the action index a (see Labyrinth.ACTIONS).
+    """
+
+    def __init__(self, environment):
+        """
+        :param {Labyrinth.Labyrinth} environment: The labyrinth
+        """
+        self.counts = numpy.zeros((environment.height * environment.width, len(ACTIONS)), dtype=numpy.uint32)
+        self.state_counts = numpy.zeros(environment.height * environment.width, dtype=numpy.uint32)
+
+    def add(self, state, action):
+        """
+        Counts a visit of the action of index action in the state of index state.
+        """
+        self.counts[state, action] += 1
+        self.state_counts[state] += 1
+
+    def clear(self):
+        self.counts[...] = 0
+        self.state_counts[...] = 0
+
+
+class Schedule:
+    """
+    Base class of the schedules.
+    """
+
+    def __call__(self, step, episode=1, visits=0):
+        raise NotImplementedError
+
+
+class Constant(Schedule):
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, step, episode=1, visits=0):
+        return self.value
+
+
+class Function(Schedule):
+    """
+    Wraps a function step -> value (the former temperature_schedule of Agent).
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, step, episode=1, visits=0):
+        return self.function(step)
+
+
+class LinearDecay(Schedule):
+    """
+    Goes linearly from start to end in duration steps (or episodes), then stays at end.
+    """
+
+    def __init__(self, start, end, duration, unit="step"):
+        if duration <= 0:
+            raise ValueError("Duration of a schedule must be positive !")
+        if unit not in UNITS:
+            raise ValueError("Unit of a schedule must be step or episode !")
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.by_episode = unit == 'episode'
+
+    def __call__(self, step, episode=1, visits=0):
+        t = episode - 1 if self.by_episode else step
+        if t >= self.duration:
+            return self.end
+        return self.start + (self.end - self.start) * t / self.duration
+
+
+class ExponentialDecay(Schedule):
+    """
+    end + (start - end) * rate ** t, t being the step (or the episode).
+    """
+
+    def __init__(self, start, end, rate, unit="step"):
+        if rate <= 0 or rate > 1:
+            raise ValueError("Rate of an exponential decay must be in range ]0, 1] !")
+        if unit not in UNITS:
+            raise ValueError("Unit of a schedule must be step or episode !")
+        self.start = start
+        self.end = end
+        self.rate = rate
+        self.by_episode = unit == 'episode'
+
+    def __call__(self, step, episode=1, visits=0):
+        t = episode - 1 if self.by_episode else step
+        return self.end + (self.start - self.end) * self.rate ** t
+
+
+class VisitDecay(Schedule):
+    """
+    max(end, start / visits ** power): e.g. the learning rate 1 / n(s, a) of the sample-average estimates.
+    visits may be an array (the batch backups of the replay buffer).
+    """
+
+    def __init__(self, start, end=0.0, power=1.0):
+        if power <= 0:
+            raise ValueError("Power of a visit decay must be positive !")
+        self.start = start
+        self.end = end
+        self.power = power
+
+    def __call__(self, step, episode=1, visits=0):
+        if isinstance(visits, numpy.ndarray):
+            return numpy.maximum(self.end, self.start / numpy.maximum(visits, 1) ** self.power)
+        return max(self.end, self.start / max(visits, 1) ** self.power)
+
+
+def as_schedule(schedule):
+    """
+    :param schedule: None, a Schedule, a number or a function step -> value
+    :return: None or a Schedule
+    """
+    if schedule is None or isinstance(schedule, Schedule):
+        return schedule
+    if callable(schedule):
+        return Function(schedule)
+    return Constant(schedule)
+
+
+def parse(spec):
+    """
+    Builds a schedule from a spec string:
+        - "constant:VALUE"
+        - "linear:START:END:DURATION[:step|episode]"
+        - "exponential:START:END:RATE[:step|episode]"
+        - "visits:START[:END[:POWER]]"
+    :param {str} spec: The spec
+    :return: A Schedule
+    """
+    (kind, *fields) = spec.split(":")
+    unit = fields.pop() if fields and fields[-1] in UNITS else "step"
+    try:
+        values = [float(field) for field in fields]
+        if kind == 'constant' and len(values) == 1:
+            return Constant(values[0])
+        if kind == 'linear' and len(values) == 3:
+            return LinearDecay(values[0], values[1], values[2], unit)
+        if kind == 'exponential' and len(values) == 3:
+            return ExponentialDecay(values[0], values[1], values[2], unit)
+        if kind == 'visits' and 1 <= len(values) <= 3:
+            return VisitDecay(*values)
+    except ValueError as error:
+        raise ValueError("Invalid schedule " + spec + ": " + str(error))
+    raise ValueError("Invalid schedule " + spec + " !")
@@ -0,0 +1,184 @@
+"""
+Hyperparameter sweep: trains one agent per combination of the grid, spread over a process pool.
+
+Every run writes its model in the JSON format of the GUI export (see model_name, e.g.
+Lab3_egreedy_0.3_50_lr0.5_dr0.5_seed0_1f2e3d4c.json) and appends a line to summary.jsonl; summary.csv is rebuilt
+from it at the end. Runs already listed in summary.jsonl with the same parameters (and whose model exists) are
+skipped, so an interrupted sweep can simply be started again.
+
+Example:
+    python Sweep.py Lab1.map Lab3.map --policy e-greedy softmax --exploration-rate 0.3 0.5 --temperature 4 \
+        --seeds 0 1 2 --output results
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import ModelIO
+from Agent import Agent
+from Labyrinth import Labyrinth
+
+SUMMARY_FIELDS = ["map", "policy", "exploration_rate", "temperature", "learning_rate", "discount_rate",
+                  "nb_episodes", "seed", "episodes", "total_steps", "last_episode_steps", "last_episode_reward",
+                  "wall_time", "model"]
+
+# Labyrinths already loaded by this worker process, by path
+_labyrinths = {}
+
+
+def load_labyrinth(path):
+    """
+    Loads a map once per process.
+    :param {str} path: The path of the .map or .npy file
+    :return: A Labyrinth.Labyrinth
+    """
+    if path not in _labyrinths:
+        _labyrinths[path] = Labyrinth.from_file(path)
+    return _labyrinths[path]
+
+
+def make_grid(maps, policies, exploration_rates, temperatures, learning_rates, discount_rates, nb_episodes, seeds):
+    """
+    Expands the grid of hyperparameters. The exploration rate only varies for e-greedy and the temperature
+    only varies for softmax.
+    :return: A list of runs (dicts of Agent parameters plus the map and the seed)
+    """
+    runs = []
+    for map_file, policy in itertools.product(maps, policies):
+        policy_rates = exploration_rates if policy == 'e-greedy' else [-1]
+        policy_temperatures = temperatures if policy == 'softmax' else [-1]
+        for exploration_rate, temperature, learning_rate, discount_rate, episodes, seed in itertools.product(
+                policy_rates, policy_temperatures, learning_rates, discount_rates, nb_episodes, seeds):
+            runs.append({
+                "map": map_file,
+                "policy": policy,
+                "exploration_rate": exploration_rate,
+                "temperature": temperature,
+                "learning_rate": learning_rate,
+                "discount_rate": discount_rate,
+                "nb_episodes": episodes,
+                "seed": seed
+            })
+    return runs
+
+
+def model_name(run):
+    """
+    :return: The file name of the model of a run, following the naming of the shipped models
+             (map_policy_parameter_episodes) plus the learning rate, the discount rate, the seed and a hash of
+             the path of the map (maps of the same name in different directories). The rates are written as
+             given (%g), not rounded to percents, so that two runs of the grid never share a name.
+    """
+    map_hash = hashlib.sha1(os.path.abspath(run["map"]).encode()).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(run["map"]))[0] + "_" + run["policy"].replace("-", "")
+    if run["policy"] == 'e-greedy':
+        name += "_%g" % run["exploration_rate"]
+    elif run["policy"] == 'softmax':
+        name += "_%g" % run["temperature"]
+    name += "_%d_lr%g_dr%g_seed%d_%s" % (run["nb_episodes"], run["learning_rate"], run["discount_rate"],
+                                         run["seed"], map_hash)
+    return name + ".json"
+
+
+def is_completed(run, rows):
+    """
+    :param {dict} run: A run (see make_grid)
+    :param {dict} rows: The summary rows of the completed runs, by model name
+    :return: True if the journal holds this very run (same name and same parameters)
+    """
+    row = rows.get(model_name(run))
+    return row is not None and all(row.get(key) == value for key, value in run.items())
+
+
+def train(job):
+    """
+    Trains one agent (executed in a worker process).
+    :param job: (run, output directory)
+    :return: The summary row of the run
+    """
+    run, output = job
+    environment = load_labyrinth(run["map"])
+    agent = Agent(run["policy"], environment, run["nb_episodes"], exploration_rate=run["exploration_rate"],
+                  temperature=run["temperature"], discount_rate=run["discount_rate"],
+                  learning_rate=run["learning_rate"], headless=True, seed=run["seed"])
+    summary = agent.learn()
+
+    model = os.path.join(output, model_name(run))
+    # written under a temporary name then renamed, so that a model on disk is always complete
+    ModelIO.save_json_model(model + ".tmp", agent.export_Q(), environment.grid.tolist(), ModelIO.agent_metadata(agent))
+    os.replace(model + ".tmp", model)
+
+    row = dict(run)
+    row.update({
+        "episodes": summary["episodes"],
+        "total_steps": sum(summary["steps"]),
+        "last_episode_steps": summary["steps"][-1] if summary["steps"] else 0,
+        "last_episode_reward": summary["rewards"][-1] if summary["rewards"] else 0.0,
+        "wall_time": summary["wall_time"],
+        "model": os.path.basename(model)
+    })
+    return row
+
+
+def sweep(runs, output, workers=None):
+    """
+    Runs every run of the grid that is not completed yet in a process pool.
+    :param {list} runs: The runs (see make_grid)
+    :param {str} output: The output directory
+    :param {int} workers: Number of processes (default: number of cores)
+    :return: The summary rows of all the completed runs
+    """
+    os.makedirs(output, exist_ok=True)
+    journal = os.path.join(output, "summary.jsonl")
+    rows = {}
+    if os.path.exists(journal):
+        with open(journal, 'r') as infile:
+            for line in infile:
+                if line.strip():
+                    row = json.loads(line)
+                    if os.path.exists(os.path.join(output, row["model"])):
+                        rows[row["model"]] = row
+
+    todo = [(run, output) for run in runs if not is_completed(run, rows)]
+    # runs on the same map are kept next to each other so that a worker reuses its loaded labyrinth
+    todo.sort(key=lambda job: job[0]["map"])
+    if todo:
+        chunksize = max(1, len(todo) // (4 * (workers or os.cpu_count())))
+        with Pool(workers) as pool, open(journal, 'a') as outfile:
+            for row in pool.imap_unordered(train, todo, chunksize=chunksize):
+                rows[row["model"]] = row
+                outfile.write(json.dumps(row) + "\n")
+                outfile.flush()
+
+    with open(os.path.join(output, "summary.csv"), 'w', newline='') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for run in runs:
+            if is_completed(run, rows):
+                writer.writerow(rows[model_name(run)])
+    return [rows[model_name(run)] for run in runs if is_completed(run, rows)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trains agents over a grid of hyperparameters.")
+    parser.add_argument("maps", nargs="+", help=".map or .npy files")
+    parser.add_argument("--policy", nargs="+", default=["e-greedy"], choices=["random", "e-greedy", "softmax"])
+    parser.add_argument("--exploration-rate", nargs="+", type=float, default=[0.3])
+    parser.add_argument("--temperature", nargs="+", type=float, default=[4])
+    parser.add_argument("--learning-rate", nargs="+", type=float, default=[0.5])
+    parser.add_argument("--discount-rate", nargs="+", type=float, default=[0.5])
+    parser.add_argument("--nb-episodes", nargs="+", type=int, default=[50])
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--output", default="results", help="output directory")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+    args = parser.parse_args()
+
+    grid = make_grid(args.maps, args.policy, args.exploration_rate, args.temperature, args.learning_rate,
+                     args.discount_rate, args.nb_episodes, args.seeds)
+    completed = sweep(grid, args.output, args.workers)
+    print("%d/%d runs completed, summary written to %s" % (len(completed), len(grid),
+                                                          os.path.join(args.output, "summary.csv")))
@@ -0,0 +1,45 @@
+import threading
+
+
+class TrainingChannel:
+    """
+    Channel between a training thread and the GUI. The training side publishes snapshots
+    (position of the agent, last action, episode, changed Q values) without ever waiting for the GUI;
+    the GUI collects them at its own frame rate. Only the latest position is kept (stale frames are
+    dropped), while the changed Q values are merged so that none of them is lost.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.q_updates = {}
+
+    def publish(self, location, action, episode, q_updates=None):
+        """
+        Publishes the state of the agent (called by the training thread).
+        :param location: The location (i, j) of the agent
+        :param action: The last action taken
+        :param episode: The current episode
+        :param q_updates: The changed Q values {(i, j, action): value}
+        """
+        with self.lock:
+            self.snapshot = (location, action, episode)
+            if q_updates:
+                self.q_updates.update(q_updates)
+
+    def collect(self):
+        """
+        Takes the latest snapshot and the Q values changed since the previous call (called by the GUI).
+        :return: (snapshot or None if nothing was published, {(i, j, action): value})
+        """
+        with self.lock:
+            snapshot, q_updates = self.snapshot, self.q_updates
+            self.snapshot = None
+            self.q_updates = {}
+        return snapshot, q_updates
+
+    def clear(self):
+        """
+        Drops everything that was published and not collected yet.
+        """
+        self.collect()
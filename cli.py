@@ -0,0 +1,261 @@
+"""
+Command-line entry point, for the batch runs on servers without display (app.py opens the Tk window).
+Nothing is imported from tkinter here.
+
+Commands:
+    train     trains an agent on a map and saves its model (.json or .qmodel)
+    evaluate  follows the greedy policy of a model from (0, 0) and reports whether it reaches the goal
+    solve     computes the optimal Q values of a map (see Planner) and saves them as a model
+
+Exit status: 0 on success, 1 if the evaluated greedy policy does not reach the goal,
+2 on invalid arguments or unreadable files.
+
+Examples:
+    python cli.py train Lab3.map --policy softmax --temperature 4 --nb-episodes 500 --seed 0 \
+        --output Lab3_softmax_4_500.json --metrics Lab3_softmax_4_500.metrics.json
+    python cli.py train Lab3.map --policy softmax --temperature 4 --nb-episodes 500 --output model.json \
+        --episode-metrics episodes.csv --profile cprofile --profile-output train.prof
+    python cli.py train big.npy --q-backend numpy --nb-episodes 100000 --output big.qmodel \
+        --checkpoint-dir big_checkpoints --checkpoint-every 1000 --resume
+    python cli.py train big.npy --q-backend numpy --workers 32 --start uniform --nb-episodes 100000 \
+        --exploration-rate 0.3 --output big.qmodel
+    python cli.py evaluate Lab3_softmax_4_500.json --optimal --discount-rate 0.5
+    python cli.py solve Lab3.map --discount-rate 0.5 --output Lab3_optimal.qmodel
+"""
+import argparse
+import json
+import sys
+from contextlib import ExitStack
+
+import Evaluation
+import Metrics
+import ModelIO
+import Planner
+import Schedule
+from Agent import Agent
+from Checkpoint import Checkpointer
+from HogwildTrainer import HogwildTrainer
+from Labyrinth import Labyrinth
+from QTable import ArrayQTable
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_ERROR = 2
+
+
+def write_metrics(path, metrics):
+    """
+    Writes the metrics of a command as JSON (nothing is written if path is None).
+    """
+    if path is None:
+        return
+    with open(path, 'w') as outfile:
+        json.dump(metrics, outfile, sort_keys=True, indent=4)
+
+
+def train(args):
+    with ExitStack() as stack:
+        metrics = None
+        if args.episode_metrics is not None:
+            metrics = stack.enter_context(Metrics.open_sink(args.episode_metrics))
+        if args.profile is not None:
+            stack.enter_context(Metrics.profile(args.profile, args.profile_output or "train." + args.profile))
+        return _train(args, metrics)
+
+
+def _train(args, metrics):
+    environment = Labyrinth.from_file(args.map)
+    if args.workers != 1:
+        return _train_parallel(args, metrics, environment)
+    checkpointer = None
+    if args.checkpoint_dir is not None:
+        checkpointer = Checkpointer(args.checkpoint_dir, args.checkpoint_every, args.checkpoint_interval,
+                                    args.checkpoint_keep)
+    elif args.resume:
+        raise ValueError("--resume needs --checkpoint-dir !")
+    agent = Agent(args.policy, environment, args.nb_episodes, exploration_rate=args.exploration_rate,
+                  temperature=args.temperature, discount_rate=args.discount_rate,
+                  learning_rate=args.learning_rate, headless=True, q_backend=args.q_backend, seed=args.seed,
+                  convergence=args.convergence, convergence_threshold=args.convergence_threshold,
+                  convergence_patience=args.convergence_patience,
+                  max_steps_per_episode=args.max_steps_per_episode, time_budget=args.time_budget, metrics=metrics,
+                  planning_steps=args.planning_steps, planning_batch_size=args.planning_batch_size,
+                  replay_capacity=args.replay_capacity, exploration_schedule=args.exploration_schedule,
+                  temperature_schedule=args.temperature_schedule, learning_rate_schedule=args.learning_rate_schedule,
+                  exploration_bonus=args.exploration_bonus, start=args.start, start_cell=args.start_cell,
+                  checkpointer=checkpointer)
+    if args.resume and agent.resume(args.checkpoint_dir):
+        print("resuming after episode %d" % agent.current_episode)
+    elif args.init is not None:
+        # training continues from the Q values of an existing model of the same map
+        model = ModelIO.load_model(args.init)
+        if model["labyrinth"].shape != environment.grid.shape or (model["labyrinth"] != environment.grid).any():
+            raise ValueError("The model " + args.init + " was not trained on " + args.map + " !")
+        agent.load_Q(ArrayQTable.from_array(model["q_values"], environment))
+    summary = agent.learn()
+
+    ModelIO.save_model(args.output, agent.Q if args.q_backend != 'dict' else agent.export_Q(), environment,
+                       ModelIO.agent_metadata(agent))
+    metrics = dict(summary)
+    metrics.update({"map": args.map, "model": args.output, "total_steps": sum(summary["steps"])})
+    write_metrics(args.metrics, metrics)
+    print("%d episodes (%s), %d steps in %.2fs, model written to %s"
+          % (summary["episodes"], summary["stop_reason"], metrics["total_steps"], summary["wall_time"], args.output))
+    return EXIT_OK
+
+
+def _train_parallel(args, metrics, environment):
+    if args.q_backend != 'numpy':
+        raise ValueError("A parallel training needs the numpy Q-table backend !")
+    if metrics is not None or args.checkpoint_dir is not None or args.init is not None:
+        raise ValueError("--episode-metrics, --checkpoint-dir and --init are not supported by a parallel training !")
+    trainer = HogwildTrainer(args.policy, environment, args.nb_episodes, args.workers or None, args.seed,
+                             start=args.start, convergence=args.convergence,
+                             convergence_threshold=args.convergence_threshold,
+                             convergence_patience=args.convergence_patience, time_budget=args.time_budget,
+                             exploration_rate=args.exploration_rate, temperature=args.temperature,
+                             discount_rate=args.discount_rate, learning_rate=args.learning_rate,
+                             max_steps_per_episode=args.max_steps_per_episode, planning_steps=args.planning_steps,
+                             planning_batch_size=args.planning_batch_size, replay_capacity=args.replay_capacity,
+                             exploration_schedule=args.exploration_schedule,
+                             temperature_schedule=args.temperature_schedule,
+                             learning_rate_schedule=args.learning_rate_schedule,
+                             exploration_bonus=args.exploration_bonus, start_cell=args.start_cell)
+    summary = trainer.train()
+
+    ModelIO.save_model(args.output, trainer.agent.Q, environment, ModelIO.agent_metadata(trainer.agent))
+    metrics = dict(summary)
+    metrics.update({"map": args.map, "model": args.output})
+    write_metrics(args.metrics, metrics)
+    print("%d episodes (%s) by %d workers, %d steps in %.2fs, model written to %s"
+          % (summary["episodes"], summary["stop_reason"], summary["workers"], summary["total_steps"],
+             summary["wall_time"], args.output))
+    return EXIT_OK
+
+
+def evaluate(args):
+    model = ModelIO.load_model(args.model)
+    environment = Labyrinth.from_file(args.map) if args.map is not None else Labyrinth(model["labyrinth"])
+    if environment.grid.shape != model["labyrinth"].shape:
+        raise ValueError("The model " + args.model + " does not fit the map !")
+    q_table = ArrayQTable.from_array(model["q_values"], environment)
+    metrics = Evaluation.evaluate(q_table, environment, max_steps=args.max_steps)
+    metrics["model"] = args.model
+    if args.optimal:
+        discount_rate = args.discount_rate
+        if discount_rate is None:
+            discount_rate = model["metadata"].get("discount_rate")
+        if discount_rate is None:
+            raise ValueError("The discount rate of the model is unknown, use --discount-rate !")
+        metrics.update(Planner.distance_to_optimum(q_table, Planner.solve(environment, discount_rate), environment))
+    write_metrics(args.metrics, metrics)
+    print(", ".join("%s: %s" % (key, metrics[key]) for key in sorted(metrics)))
+    return EXIT_OK if metrics["reached_goal"] else EXIT_FAILURE
+
+
+def solve(args):
+    environment = Labyrinth.from_file(args.map)
+    q_table = Planner.solve(environment, args.discount_rate, args.method)
+    metadata = {"method": args.method, "discount_rate": args.discount_rate}
+    ModelIO.save_model(args.output, q_table, environment, metadata)
+    metrics = Evaluation.evaluate(q_table, environment)
+    metrics.update(metadata)
+    metrics.update({"map": args.map, "model": args.output})
+    write_metrics(args.metrics, metrics)
+    print("optimal return from (0, 0): %g in %d steps, model written to %s"
+          % (metrics["return"], metrics["steps"], args.output))
+    return EXIT_OK
+
+
+def schedule(spec):
+    try:
+        return Schedule.parse(spec)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Trains, evaluates or solves labyrinths without GUI.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    train_parser = commands.add_parser("train", help="trains an agent and saves its model")
+    train_parser.add_argument("map", help=".map or .npy file")
+    train_parser.add_argument("--policy", default="e-greedy", choices=["random", "e-greedy", "softmax"])
+    train_parser.add_argument("--nb-episodes", type=int, default=50)
+    train_parser.add_argument("--exploration-rate", type=float, default=-1)
+    train_parser.add_argument("--temperature", type=float, default=-1)
+    train_parser.add_argument("--discount-rate", type=float, default=0.5)
+    train_parser.add_argument("--learning-rate", type=float, default=0.9)
+    train_parser.add_argument("--q-backend", default="dict", choices=["dict", "numpy", "sparse"])
+    train_parser.add_argument("--seed", type=int, default=None)
+    train_parser.add_argument("--convergence", default=None, choices=["q-delta", "greedy-path"])
+    train_parser.add_argument("--convergence-threshold", type=float, default=1e-3)
+    train_parser.add_argument("--convergence-patience", type=int, default=5)
+    train_parser.add_argument("--max-steps-per-episode", type=int, default=None)
+    train_parser.add_argument("--time-budget", type=float, default=None, help="in seconds")
+    train_parser.add_argument("--planning-steps", type=int, default=0,
+                              help="Dyna-Q batch backups per real step (needs --q-backend numpy)")
+    train_parser.add_argument("--planning-batch-size", type=int, default=32)
+    train_parser.add_argument("--replay-capacity", type=int, default=100000)
+    schedule_help = "e.g. linear:0.5:0.05:200:episode, exponential:1:0.01:0.999, visits:1:0.05 (see Schedule.parse)"
+    train_parser.add_argument("--exploration-schedule", type=schedule, default=None, help=schedule_help)
+    train_parser.add_argument("--temperature-schedule", type=schedule, default=None, help=schedule_help)
+    train_parser.add_argument("--learning-rate-schedule", type=schedule, default=None, help=schedule_help)
+    train_parser.add_argument("--exploration-bonus", type=float, default=0.0,
+                              help="e-greedy compares Q(s, a) + bonus / sqrt(1 + visits of (s, a))")
+    train_parser.add_argument("--start", default="fixed", choices=["fixed", "uniform", "inverse-visits"],
+                              help="distribution of the first cell of the episodes")
+    train_parser.add_argument("--start-cell", type=int, nargs=2, default=(0, 0), metavar=("I", "J"))
+    train_parser.add_argument("--workers", type=int, default=1,
+                              help="processes sharing the Q-table (0: all cores, needs --q-backend numpy)")
+    train_parser.add_argument("--init", default=None, help="model whose Q values the training starts from")
+    train_parser.add_argument("--checkpoint-dir", default=None, help="directory of the checkpoints of the training")
+    train_parser.add_argument("--checkpoint-every", type=int, default=100, help="checkpoint period, in episodes")
+    train_parser.add_argument("--checkpoint-interval", type=float, default=None,
+                              help="also checkpoints when this number of seconds passed since the last checkpoint")
+    train_parser.add_argument("--checkpoint-keep", type=int, default=3, help="number of checkpoints kept")
+    train_parser.add_argument("--resume", action="store_true",
+                              help="continues from the latest checkpoint of --checkpoint-dir, if any "
+                                   "(same arguments as the interrupted run)")
+    train_parser.add_argument("--output", required=True, help=".json or .qmodel file")
+    train_parser.add_argument("--metrics", default=None, help="JSON file of the training summary")
+    train_parser.add_argument("--episode-metrics", default=None,
+                              help=".jsonl or .csv file receiving the metrics of every episode")
+    train_parser.add_argument("--profile", default=None, choices=["cprofile", "tracemalloc"],
+                              help="profiles the training")
+    train_parser.add_argument("--profile-output", default=None,
+                              help="output of the profiler (train.cprofile or train.tracemalloc by default)")
+    train_parser.set_defaults(run=train)
+
+    evaluate_parser = commands.add_parser("evaluate", help="follows the greedy policy of a model")
+    evaluate_parser.add_argument("model", help=".json or .qmodel file")
+    evaluate_parser.add_argument("--map", default=None, help="map to evaluate on (the map of the model by default)")
+    evaluate_parser.add_argument("--max-steps", type=int, default=None)
+    evaluate_parser.add_argument("--optimal", action="store_true", help="compares the model with the optimal Q values")
+    evaluate_parser.add_argument("--discount-rate", type=float, default=None,
+                                 help="discount rate of the optimal Q values (the one of the model by default)")
+    evaluate_parser.add_argument("--metrics", default=None, help="JSON file of the evaluation")
+    evaluate_parser.set_defaults(run=evaluate)
+
+    solve_parser = commands.add_parser("solve", help="computes the optimal Q values of a map")
+    solve_parser.add_argument("map", help=".map or .npy file")
+    solve_parser.add_argument("--discount-rate", type=float, default=0.5)
+    solve_parser.add_argument("--method", default="value-iteration", choices=["value-iteration", "policy-iteration"])
+    solve_parser.add_argument("--output", required=True, help=".json or .qmodel file")
+    solve_parser.add_argument("--metrics", default=None, help="JSON file of the solution")
+    solve_parser.set_defaults(run=solve)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    try:
+        return args.run(args)
+    except (ValueError, OSError) as error:
+        print("error: " + str(error), file=sys.stderr)
+        return EXIT_ERROR
+
+
+if __name__ == '__main__':
+    sys.exit(main())